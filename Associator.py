@@ -0,0 +1,210 @@
+import numpy
+from scipy.optimize import linear_sum_assignment
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
+import time
+
+class Associator(object):
+  GATE_TYPES = ('euclidean', 'mahalanobis', 'gospa')
+  MODES = ('sparse', 'dense')
+
+  def __init__(self, gateType='euclidean', mode='sparse', continuityBonus=0.0, fields=('X', 'Y'), weights=None,
+      gospaCutoff=None, gospaOrder=2.0):
+    # Truth and tracks are compared on the given fields, each difference scaled by the square root of the
+    # field's weight (default 1), with one of these distance kernels (gateType):
+    #   euclidean: the weighted distance, gated at ASSOC_GATE
+    #   mahalanobis: the weighted distance with each difference divided by the track's SIGMA_<field>, gated
+    #                at ASSOC_GATE
+    #   gospa: the weighted distance to the power gospaOrder, cut off at gospaCutoff (ASSOC_GATE by
+    #          default). Leaving a track unassigned costs gospaCutoff**gospaOrder, so the assignment
+    #          minimizes the GOSPA metric.
+    # With a continuityBonus (sparse mode only), the scores of the truth/track pairs assigned in the previous
+    # call are lowered by it, which favors keeping assignments over switching. Calls must then come in time
+    # order.
+    if gateType not in self.GATE_TYPES:
+      raise RuntimeError('Unknown gate type: ' + str(gateType))
+    if mode not in self.MODES:
+      raise RuntimeError('Unknown association mode: ' + str(mode))
+    if mode == 'dense' and continuityBonus != 0.0:
+      raise RuntimeError('The continuity bonus is only applied in sparse association')
+    self.gateType = gateType
+    self.mode = mode
+    self.IMPOSSIBLE_SCORE = 1.0E10
+    self.NEW_TRACK_SCORE = 10.0
+    self.ASSOC_GATE = 2.0
+    self.continuityBonus = continuityBonus
+    self.fields = tuple(fields)
+    if len(self.fields) == 0:
+      raise RuntimeError('Association needs at least one field')
+    weights = numpy.ones(len(self.fields)) if weights is None else numpy.asarray(weights, float)
+    if numpy.shape(weights) != (len(self.fields),) or numpy.any(weights < 0):
+      raise RuntimeError('Association weights must be one non-negative weight per field: ' + str(weights))
+    self._weightScales = numpy.sqrt(weights)
+    self.gospaCutoff = self.ASSOC_GATE if gospaCutoff is None else gospaCutoff
+    self.gospaOrder = gospaOrder
+    if gateType == 'gospa':
+      self.NEW_TRACK_SCORE = self.gospaCutoff ** self.gospaOrder
+    self.resetContinuity()
+
+  def resetContinuity(self):
+    # Forgets the previous call's pairs, as (truth IDs, track IDs) sorted by truth ID
+    self._previousPairs = (numpy.zeros(0), numpy.zeros(0))
+
+  def associate(self, truthData, trkData):
+    # Assigns the tracks at one time to the truth at that time. Both arguments are dicts of field -> array.
+    # Returns the index of the track assigned to each truth and of the truth assigned to each track (-1 if
+    # none), the score of each truth's assignment (NaN if none), the number of tracks that fell inside the
+    # gate of any truth, and the scan's stats: time spent scoring and in linear_sum_assignment, solver
+    # calls, solved matrix cells and gated pairs.
+    numTruths = len(truthData['ID'])
+    numTracks = len(trkData['ID'])
+    truthToTrk = -1 * numpy.ones(numTruths, int)
+    trkToTruth = -1 * numpy.ones(numTracks, int)
+    self._stats = {'scoreTime': 0.0, 'solveTime': 0.0, 'numSolves': 0, 'matrixCells': 0, 'numGatedPairs': 0}
+    startTime = time.perf_counter()
+    points = self._getPoints(truthData, trkData)
+    if self.mode == 'dense':
+      assignmentMatrix = self._createAssignmentMatrix(points)
+      gated = assignmentMatrix[0:numTruths, :] < self.IMPOSSIBLE_SCORE
+      numAssociatedTrks = numpy.count_nonzero(numpy.any(gated, axis=0))
+      self._stats['numGatedPairs'] = numpy.count_nonzero(gated)
+      self._stats['scoreTime'] = time.perf_counter() - startTime
+      self._solve(assignmentMatrix, numpy.arange(numTruths), numpy.arange(numTracks), truthToTrk, trkToTruth)
+    else:
+      iTruth, iTrk, scores = self._getGatedPairs(points)
+      numAssociatedTrks = len(numpy.unique(iTrk))
+      self._stats['numGatedPairs'] = len(iTruth)
+      self._stats['scoreTime'] = time.perf_counter() - startTime
+      if self.continuityBonus != 0.0:
+        scores = self._applyContinuityBonus(truthData['ID'], trkData['ID'], iTruth, iTrk, scores)
+      self._solveClusters(iTruth, iTrk, scores, numTruths, numTracks, truthToTrk, trkToTruth)
+      if self.continuityBonus != 0.0:
+        assigned = truthToTrk >= 0
+        truthIds = truthData['ID'][assigned]
+        order = numpy.argsort(truthIds, kind='stable')
+        self._previousPairs = (truthIds[order], trkData['ID'][truthToTrk[assigned]][order])
+    truthScores = numpy.full(numTruths, numpy.nan)
+    assigned = numpy.flatnonzero(truthToTrk >= 0)
+    truthScores[assigned] = self._getScores(points, assigned, truthToTrk[assigned])
+    return {'truthToTrk': truthToTrk, 'trkToTruth': trkToTruth, 'truthScores': truthScores,
+        'numAssociatedTrks': numAssociatedTrks, 'stats': self._stats}
+
+  def associateTimes(self, timeData):
+    # Associates a sequence of (time, truthData, trkData), returning (time, truthIds, trkIds, result) for each.
+    # This is the unit of work handed to worker processes.
+    return [(time, truthData['ID'], trkData['ID'], self.associate(truthData, trkData))
+        for time, truthData, trkData in timeData]
+
+  def createAssignmentMatrix(self, truthData, trkData):
+    # Dense (numTruths + numTracks) x numTracks matrix, with a new track row for every track
+    return self._createAssignmentMatrix(self._getPoints(truthData, trkData))
+
+  def _createAssignmentMatrix(self, points):
+    numTruths = len(points[0])
+    numTracks = len(points[1])
+    assignmentMatrix = numpy.ones((numTruths + numTracks, numTracks)) * self.IMPOSSIBLE_SCORE
+    assignmentMatrix[0:numTruths, :] = self._getScores(points,
+        numpy.arange(numTruths)[:, numpy.newaxis], numpy.arange(numTracks)[numpy.newaxis, :])
+    assignmentMatrix[numTruths + numpy.arange(numTracks), numpy.arange(numTracks)] = self.NEW_TRACK_SCORE
+    return assignmentMatrix
+
+  def _getPoints(self, truthData, trkData):
+    # The association fields of the truths and the tracks as (number, fields) arrays, and what each track's
+    # differences are divided by: its sigmas for Mahalanobis, else 1
+    for data, name in ((truthData, 'truth'), (trkData, 'track')):
+      missing = [fld for fld in self.fields if fld not in data]
+      if len(missing) > 0:
+        raise RuntimeError('Association fields missing from the ' + name + ' data: ' + ', '.join(missing))
+    truthPoints = numpy.column_stack([numpy.asarray(truthData[fld], float) for fld in self.fields])
+    trkPoints = numpy.column_stack([numpy.asarray(trkData[fld], float) for fld in self.fields])
+    if self.gateType == 'mahalanobis':
+      missing = [fld for fld in self.fields if 'SIGMA_' + fld not in trkData]
+      if len(missing) > 0:
+        raise RuntimeError('Mahalanobis gating requires track fields: ' +
+            ', '.join('SIGMA_' + fld for fld in missing))
+      trkDivisors = numpy.column_stack([numpy.asarray(trkData['SIGMA_' + fld], float) for fld in self.fields])
+    else:
+      trkDivisors = numpy.ones(numpy.shape(trkPoints))
+    return (truthPoints, trkPoints, trkDivisors)
+
+  def _getScores(self, points, iTruth, iTrk):
+    # Scores the truth/track index pairs given by iTruth and iTrk (which broadcast against each other) over
+    # all fields at once, setting everything outside of the gate to IMPOSSIBLE_SCORE
+    truthPoints, trkPoints, trkDivisors = points
+    delta = (truthPoints[iTruth] - trkPoints[iTrk]) / trkDivisors[iTrk] * self._weightScales
+    scores = numpy.sqrt(numpy.sum(delta * delta, axis=-1))
+    if self.gateType == 'gospa':
+      inGate = scores < self.gospaCutoff
+      scores = scores ** self.gospaOrder
+    else:
+      inGate = scores < self.ASSOC_GATE
+    scores[numpy.logical_not(inGate)] = self.IMPOSSIBLE_SCORE
+    return scores
+
+  def _getGatedPairs(self, points):
+    # Uses KD-trees over the truth and track fields to find the candidate pairs, then scores only those. The
+    # fields are weighted and divided by their largest divisor over the tracks, which makes the tree distance
+    # a lower bound of the kernel's distance, so the tree's gate holds every pair in the kernel's gate.
+    truthPoints, trkPoints, trkDivisors = points
+    if len(truthPoints) == 0 or len(trkPoints) == 0:
+      return (numpy.zeros(0, int), numpy.zeros(0, int), numpy.zeros(0))
+    radius = self.gospaCutoff if self.gateType == 'gospa' else self.ASSOC_GATE
+    treeScales = self._weightScales / numpy.max(trkDivisors, axis=0)
+    truthTree = cKDTree(truthPoints * treeScales)
+    trkTree = cKDTree(trkPoints * treeScales)
+    pairs = truthTree.sparse_distance_matrix(trkTree, radius * (1.0 + 1.0E-9), output_type='ndarray')
+    iTruth = pairs['i'].astype(int)
+    iTrk = pairs['j'].astype(int)
+    scores = self._getScores(points, iTruth, iTrk)
+    inGate = scores < self.IMPOSSIBLE_SCORE
+    return (iTruth[inGate], iTrk[inGate], scores[inGate])
+
+  def _applyContinuityBonus(self, truthIds, trkIds, iTruth, iTrk, scores):
+    # Lowers the scores of the gated pairs that were assigned in the previous call
+    prevTruthIds, prevTrkIds = self._previousPairs
+    if len(prevTruthIds) == 0 or len(iTruth) == 0:
+      return scores
+    idx = numpy.minimum(numpy.searchsorted(prevTruthIds, truthIds[iTruth]), len(prevTruthIds) - 1)
+    carried = numpy.logical_and(prevTruthIds[idx] == truthIds[iTruth], prevTrkIds[idx] == trkIds[iTrk])
+    scores = scores.copy()
+    scores[carried] -= self.continuityBonus
+    return scores
+
+  def _solveClusters(self, iTruth, iTrk, scores, numTruths, numTracks, truthToTrk, trkToTruth):
+    # Truths and tracks linked through gated pairs form independent clusters, since every other pairing
+    # is impossible. Each cluster is its own small assignment problem.
+    if len(iTruth) == 0:
+      return
+    numNodes = numTruths + numTracks
+    graph = coo_matrix((numpy.ones(len(iTruth)), (iTruth, numTruths + iTrk)), shape=(numNodes, numNodes))
+    numClusters, labels = connected_components(graph, directed=False)
+    pairCluster = labels[iTruth]
+    order = numpy.argsort(pairCluster, kind='stable')
+    bounds = numpy.flatnonzero(numpy.diff(pairCluster[order])) + 1
+    for pairIdx in numpy.split(order, bounds):
+      if len(pairIdx) == 1:
+        # Single gated pair, which is the common case
+        if scores[pairIdx[0]] < self.NEW_TRACK_SCORE:
+          truthToTrk[iTruth[pairIdx[0]]] = iTrk[pairIdx[0]]
+          trkToTruth[iTrk[pairIdx[0]]] = iTruth[pairIdx[0]]
+        continue
+      clusterTruths, truthRows = numpy.unique(iTruth[pairIdx], return_inverse=True)
+      clusterTrks, trkCols = numpy.unique(iTrk[pairIdx], return_inverse=True)
+      numClusterTruths = len(clusterTruths)
+      numClusterTrks = len(clusterTrks)
+      assignmentMatrix = numpy.ones((numClusterTruths + numClusterTrks, numClusterTrks)) * self.IMPOSSIBLE_SCORE
+      assignmentMatrix[truthRows, trkCols] = scores[pairIdx]
+      assignmentMatrix[numClusterTruths + numpy.arange(numClusterTrks), numpy.arange(numClusterTrks)] = self.NEW_TRACK_SCORE
+      self._solve(assignmentMatrix, clusterTruths, clusterTrks, truthToTrk, trkToTruth)
+
+  def _solve(self, assignmentMatrix, truthIdx, trkIdx, truthToTrk, trkToTruth):
+    # Rows past the truths are the new track rows, so any column assigned to one stays unassigned
+    startTime = time.perf_counter()
+    rows, cols = linear_sum_assignment(assignmentMatrix)
+    self._stats['solveTime'] += time.perf_counter() - startTime
+    self._stats['numSolves'] += 1
+    self._stats['matrixCells'] += assignmentMatrix.size
+    isTruth = rows < len(truthIdx)
+    truthToTrk[truthIdx[rows[isTruth]]] = trkIdx[cols[isTruth]]
+    trkToTruth[trkIdx[cols[isTruth]]] = truthIdx[rows[isTruth]]
@@ -0,0 +1,96 @@
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import glob
+import logging
+import os
+
+import DataManager as dm
+import DataTruthAnalyzer
+import ReportGenerator
+import SiapMetrics
+
+logger = logging.getLogger(__name__)
+
+# Truth shared by all of the runs evaluated in a worker process, set once by _initWorker
+_truthManager = None
+
+def _initWorker(truthManager):
+  global _truthManager
+  _truthManager = truthManager
+
+def evaluateRun(trackFile, baseName, plotFile, analyzerKwargs, reportKwargs=None):
+  # Associates one track file against the shared truth and writes its report (if a plot file is given, or
+  # the report is a summary format that needs none). Returns the run's number of scans and overall SIAP
+  # metrics.
+  reportKwargs = reportKwargs or {}
+  dta = DataTruthAnalyzer.DataTruthAnalyzer(trackFile, _truthManager.copy(), **analyzerKwargs)
+  dta.assignTracksToTruth()
+  overall = OrderedDict((('numScans', dta.results.numTimes),))
+  overall.update(SiapMetrics.SiapMetrics(dta.results).getOverall())
+  if plotFile is not None or reportKwargs.get('outputFormat') in ReportGenerator.ReportGenerator.SUMMARY_FORMATS:
+    rg = ReportGenerator.ReportGenerator(dta, baseName, plotFile, **reportKwargs)
+    rg.generateReport()
+  return overall
+
+
+class BatchEvaluator(object):
+  # Evaluates many track files (e.g. one per tracker configuration) against the same truth. Truth is loaded
+  # and indexed once and handed to every worker process, so N runs cost about N association passes.
+
+  def __init__(self, trackFiles, truthFile, plotFile=None, numWorkers=1, cacheMode='auto', cacheDir=None,
+      analyzerKwargs=None, reportKwargs=None):
+    self.trackFiles = self.expandTrackFiles(trackFiles)
+    if len(self.trackFiles) == 0:
+      raise RuntimeError('No track files match: ' + str(trackFiles))
+    self.plotFile = plotFile
+    self.numWorkers = numWorkers
+    self.analyzerKwargs = dict(analyzerKwargs or {})
+    self.analyzerKwargs.update({'cacheMode': cacheMode, 'cacheDir': cacheDir})
+    self.reportKwargs = dict(reportKwargs or {})
+    self.truthManager = dm.DataManager(truthFile, hasId=True, cacheMode=cacheMode, cacheDir=cacheDir)
+    self.baseNames = self._getBaseNames()
+    self.runMetrics = None
+
+  @staticmethod
+  def expandTrackFiles(trackFiles):
+    # Each entry is either a file name or a glob pattern
+    expanded = []
+    for pattern in trackFiles:
+      matches = sorted(glob.glob(pattern))
+      for trackFile in (matches if len(matches) > 0 else [pattern]):
+        if trackFile not in expanded:
+          expanded.append(trackFile)
+    return expanded
+
+  def _getBaseNames(self):
+    # Report names come from the track file names, numbered when two runs would collide
+    names = [os.path.splitext(os.path.basename(trackFile))[0] + 'Report' for trackFile in self.trackFiles]
+    return [name if names.count(name) == 1 else '{0:s}{1:d}'.format(name, iRun) for iRun, name in enumerate(names)]
+
+  def evaluate(self):
+    jobs = list(zip(self.trackFiles, self.baseNames))
+    if self.numWorkers > 1:
+      with ProcessPoolExecutor(max_workers=self.numWorkers, initializer=_initWorker,
+          initargs=(self.truthManager,)) as executor:
+        futures = [executor.submit(evaluateRun, trackFile, baseName, self.plotFile, self.analyzerKwargs,
+            self.reportKwargs) for trackFile, baseName in jobs]
+        self.runMetrics = [future.result() for future in futures]
+    else:
+      _initWorker(self.truthManager)
+      self.runMetrics = [evaluateRun(trackFile, baseName, self.plotFile, self.analyzerKwargs, self.reportKwargs)
+          for trackFile, baseName in jobs]
+    return self.runMetrics
+
+  def writeSiapTable(self, fileName):
+    # One row per run, as CSV, and the same table logged for a quick look
+    header = ('run', 'trackFile', 'numScans', 'completeness', 'falseTrackRatio', 'ambiguity')
+    rows = []
+    for baseName, trackFile, overall in zip(self.baseNames, self.trackFiles, self.runMetrics):
+      rows.append((baseName, trackFile, str(overall['numScans'])) +
+          tuple('{0:.6f}'.format(overall[key]) for key in header[3:]))
+    with open(fileName, 'w') as tf:
+      for row in [header] + rows:
+        tf.write(','.join(row) + os.linesep)
+    widths = [max(len(row[iCol]) for row in [header] + rows) for iCol in range(len(header))]
+    for row in [header] + rows:
+      logger.info('%s', '  '.join(value.ljust(width) for value, width in zip(row, widths)))
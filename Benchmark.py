@@ -0,0 +1,111 @@
+import argparse
+from collections import OrderedDict
+import contextlib
+import json
+import numpy
+import os
+import platform
+import scipy
+import tempfile
+import time
+
+import DataManager as dm
+import DataTruthAnalyzer
+import Instrumentation
+import ReportGenerator
+import ScenarioGenerator
+
+class Benchmark(object):
+  # Times each stage of an analysis of a synthetic scenario: loading both files, interpolating truth,
+  # association (with the time spent building scores/matrices and in linear_sum_assignment broken out) and,
+  # if a plot file is given, report generation.
+
+  def __init__(self, scenario, workDir, analyzerKwargs=None, plotFile=None):
+    self.scenario = scenario
+    self.workDir = workDir
+    self.analyzerKwargs = dict(analyzerKwargs or {})
+    self.plotFile = plotFile
+
+  def run(self):
+    self.stages = OrderedDict()
+    truthFile = os.path.join(self.workDir, 'benchmarkTruth.txt')
+    trackFile = os.path.join(self.workDir, 'benchmarkTracks.txt')
+    with self._timed('generate'):
+      numTruthRows, numTrackRows = self.scenario.generate(truthFile, trackFile)
+    with self._timed('loadTrack'):
+      trackManager = dm.DataManager(trackFile, hasId=True, cacheMode='off')
+    with self._timed('loadTruth'):
+      truthManager = dm.DataManager(truthFile, hasId=True, cacheMode='off')
+    # Interpolated on a copy, since the analyzer interpolates the truth it is given itself
+    interpManager = truthManager.copy()
+    with self._timed('interpolateToTimeAxis'):
+      interpManager.interpolateToTimeAxis(trackManager.getUniqueTimes())
+    dta = DataTruthAnalyzer.DataTruthAnalyzer(trackManager, truthManager, **self.analyzerKwargs)
+    with self._timed('assignTracksToTruth'):
+      dta.assignTracksToTruth()
+    # In sparse mode the matrix stage covers the pre-gating and the scoring of the gated pairs
+    self.stages['createAssignmentMatrix'] = dta.metrics.getSeconds('associate.score')
+    self.stages['linear_sum_assignment'] = dta.metrics.getSeconds('associate.solve')
+    if self.plotFile is not None:
+      with self._timed('report'):
+        rg = ReportGenerator.ReportGenerator(dta, os.path.join(self.workDir, 'benchmarkReport'), self.plotFile,
+            useFigureCache=False)
+        rg.generateReport()
+    return OrderedDict((
+      ('scenario', self.scenario.getParameters()),
+      ('options', self.analyzerKwargs),
+      ('sizes', {'truthRows': numTruthRows, 'trackRows': numTrackRows, 'scans': dta.results.numTimes,
+          'truthIds': len(truthManager.idMapData), 'trackIds': len(trackManager.idMapData)}),
+      ('counters', dta.metrics.getSummary()['counters']),
+      ('stages', self.stages),
+    ))
+
+  @contextlib.contextmanager
+  def _timed(self, stage):
+    startTime = time.perf_counter()
+    yield
+    self.stages[stage] = time.perf_counter() - startTime
+
+if __name__ == '__main__':
+  ap = argparse.ArgumentParser()
+  ap.add_argument('--targets', type=int, nargs='+', dest='numTargets', default=[100],
+      help='Number of truth objects; one benchmark is run per value')
+  ap.add_argument('--duration', type=float, dest='duration', default=600.0, help='Scenario length')
+  ap.add_argument('--tracks-per-scan', type=float, dest='tracksPerScan', default=None,
+      help='Expected number of track reports per scan (overrides --clutter)')
+  ap.add_argument('--clutter', type=float, dest='clutterDensity', default=1.0E-7,
+      help='Expected false tracks per scan per unit area')
+  ap.add_argument('--seed', type=int, dest='seed', default=0, help='Random seed')
+  ap.add_argument('--assoc-mode', type=str, dest='assocMode', default='sparse', help='Association mode')
+  ap.add_argument('--workers', type=int, dest='numWorkers', default=1, help='Association worker processes')
+  ap.add_argument('--plots', type=str, dest='plotFile', default=None,
+      help='Plot configuration file; report generation is only timed if given')
+  ap.add_argument('--work-dir', type=str, dest='workDir', default=None,
+      help='Directory for the generated files (default: a temporary directory)')
+  ap.add_argument('--label', type=str, dest='label', default='', help='Label stored with the results, e.g. a version')
+  ap.add_argument('--out', type=str, dest='outFile', default='benchmark.json', help='JSON results file')
+  opts = ap.parse_args()
+  results = OrderedDict((
+    ('label', opts.label),
+    ('timestamp', time.strftime('%Y-%m-%dT%H:%M:%S')),
+    ('platform', platform.platform()),
+    ('python', platform.python_version()),
+    ('numpy', numpy.__version__),
+    ('scipy', scipy.__version__),
+    ('runs', []),
+  ))
+  with tempfile.TemporaryDirectory() as tmpDir:
+    workDir = opts.workDir if opts.workDir is not None else tmpDir
+    os.makedirs(workDir, exist_ok=True)
+    for numTargets in opts.numTargets:
+      scenario = ScenarioGenerator.ScenarioGenerator(numTargets=numTargets, duration=opts.duration,
+          tracksPerScan=opts.tracksPerScan, clutterDensity=opts.clutterDensity, seed=opts.seed)
+      bm = Benchmark(scenario, workDir, analyzerKwargs={'assocMode': opts.assocMode, 'numWorkers': opts.numWorkers},
+          plotFile=opts.plotFile)
+      run = bm.run()
+      results['runs'].append(run)
+      print('Targets: {0:d}'.format(numTargets))
+      for stage, seconds in run['stages'].items():
+        print('  {0:s}: {1:.3f} s'.format(stage, seconds))
+  with open(opts.outFile, 'w') as of:
+    json.dump(results, of, indent=1, default=Instrumentation.toJson)
@@ -0,0 +1,96 @@
+import argparse
+from collections import OrderedDict
+import logging
+import numpy
+import os
+import sys
+import tempfile
+
+import DataTruthAnalyzer
+import OnlineAnalyzer
+import ResultStore
+import ScenarioGenerator
+import StreamingReader
+
+logger = logging.getLogger(__name__)
+
+class ConsistencyCheck(object):
+  # Runs the same seeded scenario through each way of associating it (dense, sparse, parallel, streaming and
+  # online) and compares the results with those of a single process sparse run. Runs that keep the result
+  # store must match it event for event; streaming keeps only the SIAP totals, so those are compared instead.
+  TOTALS = ('numScans', 'numTruth', 'numTrksTotal', 'numAssociatedTrks', 'numAssignedTrks')
+
+  def __init__(self, scenario, workDir, numWorkers=2):
+    self.scenario = scenario
+    self.workDir = workDir
+    self.numWorkers = numWorkers
+
+  def run(self):
+    # Returns an OrderedDict of run name -> list of the differences found (empty if it matches)
+    self.truthFile = os.path.join(self.workDir, 'checkTruth.txt')
+    self.trackFile = os.path.join(self.workDir, 'checkTracks.txt')
+    self.scenario.generate(self.truthFile, self.trackFile)
+    reference = self._analyze(assocMode='sparse')
+    runs = OrderedDict((
+      ('dense', self._analyze(assocMode='dense')),
+      ('parallel', self._analyze(assocMode='sparse', numWorkers=self.numWorkers)),
+      ('streaming', self._analyze(assocMode='sparse', streaming=True)),
+      ('online', self._analyzeOnline()),
+    ))
+    differences = OrderedDict()
+    for name, dta in runs.items():
+      differences[name] = self._compareTotals(reference, dta)
+      if dta.keepHistory:
+        differences[name].extend(self._compareResults(reference.results, dta.results))
+    return differences
+
+  def _analyze(self, **kwargs):
+    dta = DataTruthAnalyzer.DataTruthAnalyzer(self.trackFile, self.truthFile, cacheMode='off', **kwargs)
+    dta.assignTracksToTruth()
+    return dta
+
+  def _analyzeOnline(self):
+    oa = OnlineAnalyzer.OnlineAnalyzer(self.truthFile, cacheMode='off')
+    for time, trkData in StreamingReader.StreamingReader(self.trackFile, hasId=True):
+      oa.pushScan(time, trkData)
+    return oa
+
+  def _compareTotals(self, reference, dta):
+    return ['{0:s}: {1} != {2}'.format(fld, getattr(dta.siapTotals, fld), getattr(reference.siapTotals, fld))
+        for fld in self.TOTALS if getattr(dta.siapTotals, fld) != getattr(reference.siapTotals, fld)]
+
+  def _compareResults(self, reference, results):
+    if (results.numTimes, results.numEvents) != (reference.numTimes, reference.numEvents):
+      return ['{0:d} times and {1:d} events != {2:d} times and {3:d} events'.format(results.numTimes,
+          results.numEvents, reference.numTimes, reference.numEvents)]
+    differences = []
+    for fld, dtype in ResultStore.ResultStore.TIME_FIELDS:
+      if not numpy.array_equal(results.getTimeColumn(fld), reference.getTimeColumn(fld)):
+        differences.append('time column ' + fld)
+    for fld, dtype in ResultStore.ResultStore.EVENT_FIELDS:
+      # Scores can round differently depending on how the pairs were scored
+      if dtype is float:
+        same = numpy.allclose(results.getEventColumn(fld), reference.getEventColumn(fld), equal_nan=True)
+      else:
+        same = numpy.array_equal(results.getEventColumn(fld), reference.getEventColumn(fld))
+      if not same:
+        differences.append('event column ' + fld)
+    return differences
+
+if __name__ == '__main__':
+  ap = argparse.ArgumentParser()
+  ap.add_argument('--targets', type=int, dest='numTargets', default=50, help='Number of truth objects')
+  ap.add_argument('--duration', type=float, dest='duration', default=120.0, help='Scenario length')
+  ap.add_argument('--clutter', type=float, dest='clutterDensity', default=1.0E-7,
+      help='Expected false tracks per scan per unit area')
+  ap.add_argument('--seed', type=int, dest='seed', default=0, help='Random seed')
+  ap.add_argument('--workers', type=int, dest='numWorkers', default=2, help='Worker processes of the parallel run')
+  opts = ap.parse_args()
+  logging.basicConfig(level=logging.WARNING, format='%(levelname)s %(name)s: %(message)s')
+  scenario = ScenarioGenerator.ScenarioGenerator(numTargets=opts.numTargets, duration=opts.duration,
+      clutterDensity=opts.clutterDensity, seed=opts.seed)
+  with tempfile.TemporaryDirectory() as workDir:
+    differences = ConsistencyCheck(scenario, workDir, numWorkers=opts.numWorkers).run()
+  for name, found in differences.items():
+    print('{0:s}: {1:s}'.format(name, 'matches' if len(found) == 0 else 'differs in ' + ', '.join(found)))
+  sys.exit(1 if any(len(found) > 0 for found in differences.values()) else 0)
@@ -1,51 +1,366 @@
+import collections
+import copy
+import hashlib
 import io
+import json
+import logging
 import numpy
 import os
 import pandas
+import shutil
 import matplotlib.pyplot as plt
 
+logger = logging.getLogger(__name__)
+
 class DataManager:
+  CACHE_MODES = ('auto', 'verify', 'refresh', 'off')
+  CACHE_VERSION = 2
+  INTERP_MODES = ('linear', 'hermite')
+  INTERP_CACHE_SIZE = 4
 
-  def __init__(self, filename, hasId=True):
-    print('I am going to open file: %s' % (filename,))
-    pd = pandas.read_table(filename, comment='#', delim_whitespace=True)
-    #print(pd)
-    fldArray = pd.keys()
-    mapping = {}
-    if 'T' in fldArray:
-      self._timeField = 'T'
-    elif 'TIME' in fldArray:
-      self._timeField = 'TIME'
+  def __init__(self, filename, hasId=True, cacheMode='auto', cacheDir=None):
+    # cacheMode controls the binary cache of the parsed file:
+    #   auto: use the cache if the file's size and mtime match it, or if only the mtime changed but the
+    #         content hash still matches; otherwise reparse and rewrite it
+    #   verify: like auto, but always check the content hash
+    #   refresh: always reparse and rewrite the cache
+    #   off: never read or write the cache
+    if cacheMode not in self.CACHE_MODES:
+      raise RuntimeError('Unknown cache mode: ' + str(cacheMode))
+    self._hasId = hasId
+    cachePath = self._getCachePath(filename, cacheDir)
+    # The cache only saves time, so when it can't be read or written the file is parsed without it
+    loaded = False
+    if cacheMode in ('auto', 'verify'):
+      try:
+        loaded = self._loadCache(filename, cachePath, cacheMode == 'verify')
+      except (OSError, ValueError, KeyError) as e:
+        logger.warning('Ignoring unreadable cache %s: %s', cachePath, e)
+    if loaded:
+      logger.info('Loaded cached file: %s', filename)
     else:
-      raise RuntimeError('Unknown time field in:' + str(fldArray))
-    self._uniqueTimes = numpy.unique(pd[self._timeField])
-    self.idMapData = {}
-    if hasId:
-      for uid in numpy.unique(pd['ID']):
+      logger.info('I am going to open file: %s', filename)
+      pd = pandas.read_table(filename, comment='#', delim_whitespace=True)
+      #print(pd)
+      fldArray = pd.keys()
+      if 'T' in fldArray:
+        self._timeField = 'T'
+      elif 'TIME' in fldArray:
+        self._timeField = 'TIME'
+      else:
+        raise RuntimeError('Unknown time field in:' + str(fldArray))
+      self._uniqueTimes = numpy.unique(pd[self._timeField])
+      if hasId:
         # Use negative ID as heartbeat, so we get the complete time axis
-        if uid < 0:
-          continue
-        intUid = int(uid)
-        idx = numpy.where(pd['ID'] == uid)[0]
-        self.idMapData[intUid] = {}
-        for fld in fldArray:
-          #print(iFld)
-          self.idMapData[intUid][fld] = pd[fld][idx]
-      print(self.idMapData)
+        valid = pd['ID'].values >= 0
+      else:
+        valid = numpy.ones(len(pd), bool)
+      self._buildTimeIndex({fld: pd[fld].values[valid] for fld in fldArray}, self._uniqueTimes)
+      if cacheMode != 'off':
+        try:
+          self._writeCache(filename, cachePath)
+        except (OSError, ValueError) as e:
+          logger.warning('Could not write the cache %s: %s', cachePath, e)
+      logger.info('Done reading file: %s', filename)
+    self._initIdData()
+
+  @classmethod
+  def fromColumns(cls, columns, timeField, uniqueTimes, hasId=True):
+    # A DataManager over data already in memory, e.g. read by StreamingReader, as a dict of field -> array
+    # in any order. uniqueTimes are the times of the whole file, heartbeats included.
+    self = cls.__new__(cls)
+    self._hasId = hasId
+    self._timeField = timeField
+    self._uniqueTimes = numpy.asarray(uniqueTimes)
+    self._buildTimeIndex(columns, self._uniqueTimes)
+    self._initIdData()
+    return self
+
+  def _initIdData(self):
+    mapping = {}
+    self.idMapData = {}
+    if self._hasId:
+      self.idMapData = self._getIdViews(self.columns)
+      logger.debug('%s', self.idMapData)
     else:
       self.idMapData[0] = mapping
-    print('Done reading file: {0:s}'.format(filename))
+    # The data as loaded, which interpolateToTimeAxis always resamples from and getInterpolatedDataAtTime
+    # always interpolates from
+    self.rawColumns = self.columns
+    self.rawIdMapData = self.idMapData
+    self._rawTimeOrder = self._timeOrder
+    self._rawSortedTimes = self._sortedTimes
+    self._nextRow = None
+    self._interpCache = collections.OrderedDict()
+
+  def _getCachePath(self, filename, cacheDir):
+    # The cache lives next to the input unless a cache directory is given, in which case the absolute path
+    # of the input is hashed into the name so that inputs with the same base name don't collide
+    if cacheDir is None:
+      return filename + '.dtacache'
+    pathHash = hashlib.sha1(os.path.abspath(filename).encode()).hexdigest()[0:12]
+    return os.path.join(cacheDir, '{0:s}.{1:s}.dtacache'.format(os.path.basename(filename), pathHash))
+
+  def _hashFile(self, filename):
+    sha = hashlib.sha1()
+    with open(filename, 'rb') as f:
+      for block in iter(lambda: f.read(1 << 20), b''):
+        sha.update(block)
+    return sha.hexdigest()
+
+  def _loadCache(self, filename, cachePath, verify):
+    # Returns whether the cache was valid and loaded. Columns are memory-mapped, so this is nearly free.
+    metaFile = os.path.join(cachePath, 'meta.json')
+    if not os.path.isfile(metaFile):
+      return False
+    with open(metaFile, 'r') as mf:
+      meta = json.load(mf)
+    stat = os.stat(filename)
+    if meta.get('version') != self.CACHE_VERSION or meta['path'] != os.path.abspath(filename) or \
+        meta['size'] != stat.st_size or meta['hasId'] != self._hasId:
+      return False
+    if verify or meta['mtime'] != stat.st_mtime:
+      if self._hashFile(filename) != meta['sha1']:
+        return False
+      if meta['mtime'] != stat.st_mtime:
+        # Only touched, so remember the new mtime to skip hashing next time
+        meta['mtime'] = stat.st_mtime
+        with open(metaFile, 'w') as mf:
+          json.dump(meta, mf)
+    self._timeField = meta['timeField']
+    self._uniqueTimes = numpy.load(os.path.join(cachePath, 'uniqueTimes.npy'))
+    columns = collections.OrderedDict()
+    for iFld, fld in enumerate(meta['fields']):
+      columns[fld] = numpy.load(os.path.join(cachePath, 'col{0:d}.npy'.format(iFld)), mmap_mode='r')
+    timeOrder = numpy.load(os.path.join(cachePath, 'timeOrder.npy'), mmap_mode='r')
+    self._buildTimeIndex(columns, self._uniqueTimes, isSorted=True, timeOrder=timeOrder)
+    return True
+
+  def _writeCache(self, filename, cachePath):
+    # Written to a temporary directory first, so an interrupted write never leaves a cache that looks valid
+    stat = os.stat(filename)
+    meta = {'version': self.CACHE_VERSION, 'path': os.path.abspath(filename), 'size': stat.st_size,
+        'mtime': stat.st_mtime, 'sha1': self._hashFile(filename), 'hasId': self._hasId,
+        'timeField': self._timeField, 'fields': list(self.columns.keys())}
+    tmpPath = cachePath + '.tmp{0:d}'.format(os.getpid())
+    try:
+      os.makedirs(tmpPath, exist_ok=True)
+      numpy.save(os.path.join(tmpPath, 'uniqueTimes.npy'), self._uniqueTimes)
+      numpy.save(os.path.join(tmpPath, 'timeOrder.npy'), self._timeOrder)
+      for iFld, fldData in enumerate(self.columns.values()):
+        numpy.save(os.path.join(tmpPath, 'col{0:d}.npy'.format(iFld)), fldData)
+      with open(os.path.join(tmpPath, 'meta.json'), 'w') as mf:
+        json.dump(meta, mf)
+      if os.path.isdir(cachePath):
+        shutil.rmtree(cachePath)
+      os.rename(tmpPath, cachePath)
+    except Exception:
+      shutil.rmtree(tmpPath, ignore_errors=True)
+      raise
+
+  def _buildTimeIndex(self, columns, indexTimes, isSorted=False, timeOrder=None):
+    # Keep one structure-of-arrays table sorted by ID (and by time within an ID), so each ID's data is a
+    # slice of it, plus the permutation that puts its rows in time order (by ID within a time) and the
+    # start/end offsets of every index time into that permutation, so the rows at a time are found without
+    # a search. isSorted says the columns are already in (ID, time) order, and timeOrder may be given if known.
+    if isSorted:
+      self.columns = collections.OrderedDict(columns)
+    else:
+      times = numpy.asarray(columns[self._timeField])
+      if self._hasId:
+        order = numpy.lexsort((times, columns['ID']))
+      else:
+        order = numpy.argsort(times, kind='stable')
+      self.columns = collections.OrderedDict((fld, numpy.asarray(fldData)[order]) for fld, fldData in columns.items())
+    times = self.columns[self._timeField]
+    if self._hasId:
+      ids = self.columns['ID']
+      dup = numpy.where((times[1:] == times[:-1]) & (ids[1:] == ids[:-1]))[0]
+      if len(dup) > 0:
+        raise RuntimeError('Track', ids[dup[0]], 'has duplicate data at time', times[dup[0]])
+    if timeOrder is None:
+      # A stable sort keeps the ID order within a time
+      timeOrder = numpy.argsort(times, kind='stable')
+    self._timeOrder = timeOrder
+    self._sortedTimes = times[timeOrder]
+    self._indexTimes = numpy.asarray(indexTimes)
+    self._timeStarts = numpy.searchsorted(self._sortedTimes, self._indexTimes, side='left')
+    self._timeEnds = numpy.searchsorted(self._sortedTimes, self._indexTimes, side='right')
+
+  def _getIdViews(self, columns):
+    # Each ID's data as views of the (ID, time) ordered columns, from the boundaries between IDs
+    ids = columns['ID']
+    starts = numpy.flatnonzero(numpy.append(True, ids[1:] != ids[:-1])) if len(ids) > 0 else numpy.zeros(0, int)
+    ends = numpy.append(starts[1:], len(ids))
+    return {int(ids[start]): {fld: fldData[start:end] for fld, fldData in columns.items()}
+        for start, end in zip(starts, ends)}
+
+  def copy(self):
+    # Returns a copy that shares the loaded arrays and the interpolation cache. interpolateToTimeAxis replaces
+    # arrays instead of writing into them, so the copy can be interpolated without touching this one.
+    other = copy.copy(self)
+    other.idMapData = {id: dict(thisIdData) for id, thisIdData in self.idMapData.items()}
+    return other
 
   def getUniqueTimes(self):
     return self._uniqueTimes
 
-  def interpolateToTimeAxis(self, timeAxis):
-    for id, thisIdData in self.idMapData.items():
-      for fld, fldData in thisIdData.items():
-        # Must interpolate time field at the end, otherwise the other interpolations won't be correct
-        if fld != self._timeField:
-          self.idMapData[id][fld] = numpy.interp(timeAxis, thisIdData[self._timeField], fldData, left=numpy.nan, right=numpy.nan)
-      self.idMapData[id][self._timeField] = timeAxis
+  def interpolateToTimeAxis(self, timeAxis, mode='linear'):
+    # Resamples every ID to the times of the (increasing) timeAxis within its own span, replacing
+    # idMapData and the time index. The loaded samples stay in rawColumns and rawIdMapData, and every call
+    # resamples from them, so interpolating again doesn't compound. Results are kept per axis and mode
+    # (shared with copies), so repeating a call only swaps the cached tables back in.
+    #   linear: straight lines between samples, the same values numpy.interp gives
+    #   hermite: cubic Hermite with finite-difference tangents, smooth through the samples
+    if mode not in self.INTERP_MODES:
+      raise RuntimeError('Unknown interpolation mode: ' + str(mode))
+    if not self._hasId:
+      raise RuntimeError('Interpolation needs an ID field')
+    timeAxis = numpy.asarray(timeAxis)
+    key = (mode, hashlib.sha1(numpy.ascontiguousarray(timeAxis, float).tobytes()).hexdigest())
+    if key not in self._interpCache:
+      if len(self._interpCache) >= self.INTERP_CACHE_SIZE:
+        self._interpCache.popitem(last=False)
+      self._interpCache[key] = self._resample(timeAxis, mode)
+    columns, idMapData, timeOrder, sortedTimes, timeStarts, timeEnds = self._interpCache[key]
+    self.columns = columns
+    self.idMapData = {id: dict(thisIdData) for id, thisIdData in idMapData.items()}
+    self._indexTimes = timeAxis
+    self._timeOrder = timeOrder
+    self._sortedTimes = sortedTimes
+    self._timeStarts = timeStarts
+    self._timeEnds = timeEnds
+
+  def _resample(self, timeAxis, mode):
+    # All IDs and fields are resampled together: the raw rows, which are sorted by (ID, time), are packed
+    # with one row of values per field, and each output sample indexes the raw samples on either side of it.
+    raw = self.rawColumns
+    ids = raw['ID']
+    times = raw[self._timeField]
+    flds = [fld for fld in raw.keys() if fld not in ('ID', self._timeField)]
+    values = numpy.array([numpy.asarray(raw[fld], float) for fld in flds]).reshape(len(flds), len(ids))
+    if len(ids) > 0:
+      starts = numpy.flatnonzero(numpy.append(True, ids[1:] != ids[:-1]))
+      ends = numpy.append(starts[1:], len(ids))
+    else:
+      starts = numpy.zeros(0, int)
+      ends = numpy.zeros(0, int)
+
+    # The part of the axis inside each ID's span, as (ID, time) pairs in the same order as the raw rows
+    first = numpy.searchsorted(timeAxis, times[starts], side='left')
+    counts = numpy.maximum(numpy.searchsorted(timeAxis, times[ends - 1], side='right') - first, 0)
+    outStarts = numpy.cumsum(counts) - counts
+    group = numpy.repeat(numpy.arange(len(starts)), counts)
+    outIds = ids[starts][group]
+    outTimes = timeAxis[numpy.arange(len(group)) - outStarts[group] + first[group]]
+
+    # Raw rows sort ahead of output samples at the same (ID, time), so the number of raw rows ahead of an
+    # output sample is one past its left raw sample
+    isOut = numpy.append(numpy.zeros(len(ids), bool), numpy.ones(len(outIds), bool))
+    merged = numpy.lexsort((isOut, numpy.append(times, outTimes), numpy.append(ids, outIds)))
+    lo = numpy.cumsum(numpy.logical_not(isOut[merged]))[isOut[merged]] - 1
+    hi = numpy.minimum(lo + 1, ends[group] - 1)
+    dt = times[hi] - times[lo]
+    offset = outTimes - times[lo]
+    v0 = values[:, lo]
+    v1 = values[:, hi]
+    if mode == 'linear':
+      slope = numpy.divide(v1 - v0, dt, out=numpy.zeros_like(v0), where=dt > 0)
+      resampled = slope * offset + v0
+    else:
+      tangents = self._getHermiteTangents(times, values, ends)
+      w = numpy.divide(offset, dt, out=numpy.zeros(len(dt)), where=dt > 0)
+      w2 = w * w
+      w3 = w2 * w
+      resampled = ((2.0 * w3 - 3.0 * w2 + 1.0) * v0 + (w3 - 2.0 * w2 + w) * dt * tangents[:, lo]
+          + (3.0 * w2 - 2.0 * w3) * v1 + (w3 - w2) * dt * tangents[:, hi])
+
+    columns = collections.OrderedDict()
+    for fld in raw.keys():
+      if fld == 'ID':
+        columns[fld] = outIds
+      elif fld == self._timeField:
+        columns[fld] = outTimes
+      else:
+        columns[fld] = resampled[flds.index(fld)]
+    # Per-ID data are views of the (ID, time) ordered columns; IDs outside the axis keep empty arrays
+    idMapData = {}
+    for iId, id in enumerate(ids[starts]):
+      outStart = outStarts[iId]
+      idMapData[int(id)] = {fld: fldData[outStart:outStart + counts[iId]] for fld, fldData in columns.items()}
+    self._buildTimeIndex(columns, timeAxis, isSorted=True)
+    return (self.columns, idMapData, self._timeOrder, self._sortedTimes, self._timeStarts, self._timeEnds)
+
+  def _getHermiteTangents(self, times, values, ends):
+    # The mean of the secant slopes on either side of each sample, one-sided at the first and last
+    # samples of an ID, and zero for an ID with a single sample
+    inId = numpy.ones(max(len(times) - 1, 0), bool)
+    inId[ends[:-1] - 1] = False
+    secants = numpy.zeros((len(values), len(inId)))
+    secants[:, inId] = numpy.diff(values, axis=1)[:, inId] / numpy.diff(times)[inId]
+    tangents = numpy.zeros_like(values)
+    tangents[:, 1:] += secants
+    tangents[:, :-1] += secants
+    both = numpy.logical_and(numpy.append(False, inId), numpy.append(inId, False))
+    tangents[:, both] *= 0.5
+    return tangents
+
+  def getDataAtTime(self, time):
+    # Returns a dict of field -> array holding every ID's data at the given time, ordered by ID
+    iTime = numpy.searchsorted(self._indexTimes, time)
+    if iTime < len(self._indexTimes) and self._indexTimes[iTime] == time:
+      rows = self._timeOrder[self._timeStarts[iTime]:self._timeEnds[iTime]]
+    else:
+      rows = numpy.zeros(0, int)
+    return {fld: fldData[rows] for fld, fldData in self.columns.items()}
+
+  def getInterpolatedDataAtTime(self, time):
+    # Interpolates every ID that exists at this time from the loaded samples, whatever interpolateToTimeAxis
+    # resampled to, returning the same layout as getDataAtTime. Calls are cheapest when the time doesn't
+    # decrease between them: a cursor walks the raw rows in time order keeping the latest row of each ID at
+    # or before the time, so each row is only visited once.
+    if self._nextRow is None:
+      self._initCursor()
+    if time < self._cursorTime:
+      self._cursor = 0
+      self._activeRows = numpy.zeros(0, int)
+    raw = self.rawColumns
+    times = raw[self._timeField]
+    end = numpy.searchsorted(self._rawSortedTimes, time, side='right')
+    rows = numpy.concatenate((self._activeRows, self._rawTimeOrder[self._cursor:end]))
+    nextRows = self._nextRow[rows]
+    # Rows superseded by a later row at or before this time, and IDs that already ended, are dropped
+    rows = rows[numpy.where(nextRows >= 0, times[nextRows] > time, times[rows] == time)]
+    self._activeRows = rows
+    self._cursor = end
+    self._cursorTime = time
+
+    # Rows are in ID order already, so sorting them orders the IDs
+    rows = numpy.sort(rows)
+    nextRows = self._nextRow[rows]
+    interp = nextRows >= 0
+    t0 = times[rows[interp]]
+    t1 = times[nextRows[interp]]
+    data = {}
+    for fld, fldData in raw.items():
+      if fld in ('ID', self._timeField):
+        data[fld] = fldData[rows]
+      else:
+        data[fld] = numpy.asarray(fldData[rows], float)
+        v0 = data[fld][interp]
+        slope = (fldData[nextRows[interp]] - v0) / (t1 - t0)
+        data[fld][interp] = slope * (time - t0) + v0
+    data[self._timeField] = numpy.full(len(rows), float(time))
+    return data
+
+  def _initCursor(self):
+    # Index of the next raw row of the same ID for every raw row, or -1 for an ID's last row
+    ids = self.rawColumns['ID']
+    same = numpy.append(ids[1:] == ids[:-1], False)
+    self._nextRow = numpy.where(same, numpy.arange(1, len(ids) + 1), -1)
+    self._cursor = 0
+    self._cursorTime = -numpy.inf
+    self._activeRows = numpy.zeros(0, int)
 
   def getIndividualDataAtTime(self, data, time):
     returnData = None
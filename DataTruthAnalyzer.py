@@ -1,133 +1,279 @@
 import argparse
-from collections import OrderedDict
-import math
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+import logging
 import numpy
 import os
-from scipy.optimize import linear_sum_assignment
 
+import Associator
 import DataManager as dm
+import Instrumentation
 import ReportGenerator
+import ResultStore
+import SiapMetrics
+import StreamingReader
+
+logger = logging.getLogger(__name__)
 
 class DataTruthAnalyzer(object):
-  def __init__(self, trackFile, truthFile):
-    self.trackManager = dm.DataManager(trackFile, hasId=True)
-    self.truthManager = dm.DataManager(truthFile, hasId=True)
-    self.IMPOSSIBLE_SCORE = 1.0E10
-    self.NEW_TRACK_SCORE = 10.0
-    self.ASSOC_GATE = 2.0
+  def __init__(self, trackFile, truthFile, gateType='euclidean', assocMode='sparse', numWorkers=1, chunkSize=64,
+      streaming=False, streamChunkRows=100000, truthLookahead=60.0, cacheMode='auto', cacheDir=None,
+      interpMode='linear', **assocKwargs):
+    # assocKwargs are the other Associator options (continuityBonus, fields, weights, gospaCutoff, gospaOrder)
+    self._initAssociator(gateType, assocMode, assocKwargs)
+    self.interpMode = interpMode
+    if self.associator.continuityBonus != 0.0 and numWorkers > 1:
+      # Each scan's scores depend on the assignment of the one before it, so the times can't be split between
+      # workers
+      logger.warning('The continuity bonus links each scan to the one before it, so it runs in a single process')
+      numWorkers = 1
+    self.numWorkers = numWorkers
+    self.chunkSize = chunkSize
+    self.streaming = streaming
+    # Streaming only keeps the running SIAP totals, so memory is bounded by the truth window rather than by
+    # the length of the files
+    self.keepHistory = not streaming
+    self.streamChunkRows = streamChunkRows
+    self.truthLookahead = truthLookahead
+    self.metrics = Instrumentation.Metrics()
+    self._loadData(trackFile, truthFile, cacheMode, cacheDir)
     self.initData()
 
+  def _initAssociator(self, gateType, assocMode, assocKwargs):
+    self.associator = Associator.Associator(gateType=gateType, mode=assocMode, **assocKwargs)
+
+  def _loadData(self, trackFile, truthFile, cacheMode, cacheDir):
+    # Subclasses that get their data some other way (e.g. track scans pushed one at a time) override this
+    if self.streaming:
+      # Files are read while associating, so the per-ID data is never held (or available) in full
+      self.trackFile = trackFile
+      self.truthFile = truthFile
+      self.trackManager = None
+      self.truthManager = None
+    else:
+      with self.metrics.stage('loadTrack'):
+        self.trackManager = self._getManager(trackFile, cacheMode, cacheDir)
+      with self.metrics.stage('loadTruth'):
+        self.truthManager = self._getManager(truthFile, cacheMode, cacheDir)
+
+  def _getManager(self, dataFile, cacheMode, cacheDir):
+    # Either file can be given as an already loaded DataManager, e.g. truth shared between several runs
+    if isinstance(dataFile, dm.DataManager):
+      return dataFile
+    return dm.DataManager(dataFile, hasId=True, cacheMode=cacheMode, cacheDir=cacheDir)
+
   def initData(self):
-    self.truthAssignments = {}
-    self.trackAssignments = {}
-    for truthId in self.truthManager.idMapData.keys():
-      self.truthAssignments[truthId] = {}
-      self.truthAssignments[truthId]['TIME'] = []
-      self.truthAssignments[truthId]['TRK_IDS'] = []
-    for trkId in self.trackManager.idMapData.keys():
-      self.trackAssignments[trkId] = {}
-      self.trackAssignments[trkId]['TIME'] = []
-      self.trackAssignments[trkId]['TRUTH_IDS'] = []
+    self.results = ResultStore.ResultStore()
+    self.siapTotals = SiapMetrics.SiapTotals()
 
   def assignTracksToTruth(self):
-    uTimes = self.trackManager.getUniqueTimes()
-    #print('Unique times:', uTimes)
-    self.truthManager.interpolateToTimeAxis(uTimes)
-    #print('Interpolated truth data:', self.truthManager.idMapData)
-    self.allTimeData = OrderedDict()
-    for time in uTimes:
-      print('****  Time = ', time, ' *****')
-      validTrkIds = []
-      validTruthIds = []
-      thisTimeTrkData = []
-      thisTimeTruthData = []
-      for trkId, trkData in self.trackManager.idMapData.items():
-        tmpTrkData = self.trackManager.getIndividualDataAtTime(trkData, time)
-        if tmpTrkData is not None:
-          validTrkIds.append(trkId)
-          thisTimeTrkData.append(tmpTrkData)
-      #print 'validTrkIds:', validTrkIds
-      for truthId, truthData in self.truthManager.idMapData.items():
-        # Due to interpolation above, this time has to exist
-        tmpTruthData = self.truthManager.getIndividualDataAtTime(truthData, time)
-        if not numpy.isnan(tmpTruthData['ID']):
-          validTruthIds.append(truthId)
-          thisTimeTruthData.append(tmpTruthData)
-      #print 'validTruthIds:', validTruthIds
-      self._createAssignmentMatrix(thisTimeTrkData, thisTimeTruthData, time)
-      numAssociatedTrks = 0
-      for iTrk, trkId in enumerate(validTrkIds):
-        trkScores = self.assignmentMatrix[0:len(validTruthIds), iTrk]
-        numAssociatedTrks += numpy.any(trkScores < self.IMPOSSIBLE_SCORE)
-        #print 'Any for trkIdx:', iTrk, 'id:', trkId, trkScores < self.IMPOSSIBLE_SCORE
-        #print '  from', trkScores
-      #print 'assMatrix:', os.linesep, self.assignmentMatrix
-      #print 'Associated Tracks:', numAssociatedTrks
-      truthToTrk, trkToTruth = linear_sum_assignment(self.assignmentMatrix)
-      truthTrackAssignment = -1*numpy.ones(numpy.shape(validTruthIds), numpy.int)
-      trackTruthAssignment = -1*numpy.ones(numpy.shape(validTrkIds), numpy.int)
-      numAssignedTrks = 0
-      for iTruth, truthId in enumerate(validTruthIds):
-        assignedTrk = -1
-        if iTruth in truthToTrk:
-          numAssignedTrks += 1
-          trkIdx = trkToTruth[iTruth]
-          assignedTrk = validTrkIds[trkIdx]
-          truthTrackAssignment[iTruth] = assignedTrk
-          trackTruthAssignment[trkIdx] = truthId
-          print('Truth', truthId, 'assigned to', assignedTrk)
+    self.initData()
+    if self.streaming:
+      timeData = self._streamTimeData()
+    else:
+      uTimes = self.trackManager.getUniqueTimes()
+      with self.metrics.stage('interpolateTruth'):
+        self.truthManager.interpolateToTimeAxis(uTimes, mode=self.interpMode)
+      # Every time has at most one event per truth and per track, so the results never need to grow
+      self.results.reserve(len(uTimes), len(self.truthManager.columns['ID']) + len(self.trackManager.columns['ID']))
+      # Both managers keep a time index, so all of the data at a time is a slice
+      timeData = ((time, self.truthManager.getDataAtTime(time), self.trackManager.getDataAtTime(time))
+          for time in uTimes)
+    self.associator.resetContinuity()
+    with self.metrics.stage('associate'):
+      if self.numWorkers > 1:
+        self._assignInParallel(timeData)
+      else:
+        for time, thisTimeTruthData, thisTimeTrkData in timeData:
+          result = self.associator.associate(thisTimeTruthData, thisTimeTrkData)
+          self._recordTimeData(time, self._makeTimeData(thisTimeTruthData['ID'], thisTimeTrkData['ID'], result))
+    logger.debug('Stored %d times and %d assignment events', self.results.numTimes, self.results.numEvents)
+
+  def _streamTimeData(self):
+    # Track times come off the track file in order, and truth is interpolated to each from a bounded window
+    trackReader = StreamingReader.StreamingReader(self.trackFile, hasId=True, chunkRows=self.streamChunkRows)
+    truthInterpolator = StreamingReader.StreamingTruthInterpolator(self.truthFile, lookahead=self.truthLookahead,
+        chunkRows=self.streamChunkRows)
+    for time, thisTimeTrkData in trackReader:
+      yield (time, truthInterpolator.getDataAtTime(time), thisTimeTrkData)
+
+  def _assignInParallel(self, timeData):
+    # Each time only depends on its own track and truth data, so chunks of times are associated in worker
+    # processes. Only a few chunks per worker are in flight at once, and results are merged in time order.
+    pending = deque()
+    with ProcessPoolExecutor(max_workers=self.numWorkers) as executor:
+      while True:
+        chunk = list(itertools.islice(timeData, self.chunkSize))
+        if len(chunk) == 0:
+          break
+        pending.append(executor.submit(self.associator.associateTimes, chunk))
+        if len(pending) >= 2 * self.numWorkers:
+          self._recordChunk(pending.popleft().result())
+      while len(pending) > 0:
+        self._recordChunk(pending.popleft().result())
+
+  def _recordChunk(self, chunkResults):
+    for time, truthIds, trkIds, result in chunkResults:
+      self._recordTimeData(time, self._makeTimeData(truthIds, trkIds, result))
+
+  def _makeTimeData(self, truthIds, trkIds, result):
+    # Turns an association result (indexes into the truth and track data) into the per-time summary by ID
+    validTrkIds = numpy.asarray(trkIds).astype(int)
+    validTruthIds = numpy.asarray(truthIds).astype(int)
+    truthToTrk = result['truthToTrk']
+    trkToTruth = result['trkToTruth']
+    self._countScan(validTruthIds, validTrkIds, result['stats'])
+    truthTrackAssignment = -1*numpy.ones(numpy.shape(validTruthIds), int)
+    trackTruthAssignment = -1*numpy.ones(numpy.shape(validTrkIds), int)
+    assigned = truthToTrk >= 0
+    truthTrackAssignment[assigned] = validTrkIds[truthToTrk[assigned]]
+    assigned = trkToTruth >= 0
+    trackTruthAssignment[assigned] = validTruthIds[trkToTruth[assigned]]
+
+    thisTimeData = {}
+    thisTimeData['numAssociatedTrks'] = result['numAssociatedTrks']
+    thisTimeData['numAssignedTrks'] = numpy.count_nonzero(truthToTrk >= 0)
+    thisTimeData['validTrkIds'] = validTrkIds
+    thisTimeData['validTruthIds'] = validTruthIds
+    thisTimeData['truthTrackAssignment'] = truthTrackAssignment
+    thisTimeData['trackTruthAssignment'] = trackTruthAssignment
+    thisTimeData['truthScores'] = result['truthScores']
+    return thisTimeData
+
+  def _countScan(self, truthIds, trkIds, stats):
+    # Time spent scoring and solving is summed over scans (in the workers when associating in parallel)
+    self.metrics.addTime('associate.score', stats['scoreTime'])
+    self.metrics.addTime('associate.solve', stats['solveTime'], calls=stats['numSolves'])
+    self.metrics.count('truthsPerScan', len(truthIds))
+    self.metrics.count('tracksPerScan', len(trkIds))
+    self.metrics.count('matrixCells', stats['matrixCells'])
+    self.metrics.count('gatedPairs', stats['numGatedPairs'])
+    self.metrics.count('solverCalls', stats['numSolves'])
+
+  def _recordTimeData(self, time, thisTimeData):
+    if logger.isEnabledFor(logging.DEBUG):
+      logger.debug('****  Time = %s *****', time)
+      for truthId, assignedTrk in zip(thisTimeData['validTruthIds'], thisTimeData['truthTrackAssignment']):
+        if assignedTrk >= 0:
+          logger.debug('Truth %d assigned to %d', truthId, assignedTrk)
         else:
-          print('Truth', truthId, 'not assigned')
-        self.truthAssignments[truthId]['TRK_IDS'].append(assignedTrk)
-        self.truthAssignments[truthId]['TIME'].append(time)
-      for iTrk, trkId in enumerate(validTrkIds):
-        assignedTruth = -1
-        if iTrk in trkToTruth:
-          truthIdx = truthToTrk[iTrk]
-          if truthIdx < len(validTruthIds):
-            assignedTruth = validTruthIds[truthIdx]
-        self.trackAssignments[trkId]['TRUTH_IDS'].append(assignedTruth)
-        self.trackAssignments[trkId]['TIME'].append(time)
-
-      thisTimeData = {}
-      thisTimeData['numAssociatedTrks'] = numAssociatedTrks
-      thisTimeData['numAssignedTrks'] = numAssignedTrks
-      thisTimeData['validTrkIds'] = numpy.array(validTrkIds)
-      thisTimeData['validTruthIds'] = numpy.array(validTruthIds)
-      thisTimeData['truthTrackAssignment'] = numpy.array(truthTrackAssignment)
-      thisTimeData['trackTruthAssignment'] = numpy.array(trackTruthAssignment)
-      self.allTimeData[time] = thisTimeData
-    print('allTimeData:', self.allTimeData)
-
-  def _createAssignmentMatrix(self, thisTimeTrkData, thisTimeTruthData, time):
-    numTruths = len(thisTimeTruthData)
-    numTracks = len(thisTimeTrkData)
-    truthIds = [tmp['ID'] for tmp in thisTimeTruthData]
-    trkIds = [tmp['ID'] for tmp in thisTimeTrkData]
-    self.assignmentMatrix = numpy.ones((numTruths + numTracks, numTracks)) * self.IMPOSSIBLE_SCORE
-    for iTruth, truthId in enumerate(truthIds):
-      for iTrk, trkId in enumerate(trkIds):
-        truthData = thisTimeTruthData[iTruth]
-        trkData = thisTimeTrkData[iTrk]
-        self.assignmentMatrix[iTruth, iTrk] = self._getScore(truthData, trkData)
-    for iTrk, trkId in enumerate(trkIds):
-      self.assignmentMatrix[iTrk + numTruths, iTrk] = self.NEW_TRACK_SCORE
-    
-  def _getScore(self, truthData, trackData):
-    deltaX = truthData['X'] - trackData['X']
-    deltaY = truthData['Y'] - trackData['Y']
-    score = math.sqrt(deltaX * deltaX + deltaY * deltaY)
-    return score if score < self.ASSOC_GATE else self.IMPOSSIBLE_SCORE
+          logger.debug('Truth %d not assigned', truthId)
+    self.siapTotals.update(thisTimeData)
+    if not self.keepHistory:
+      return
+    self.results.addTime(time, thisTimeData['validTruthIds'], thisTimeData['truthTrackAssignment'],
+        thisTimeData['truthScores'], thisTimeData['validTrkIds'], thisTimeData['trackTruthAssignment'],
+        thisTimeData['numAssociatedTrks'])
 
 if __name__ == '__main__':
   ap = argparse.ArgumentParser()
   ap.add_argument('--track', type=str, dest='trackFile', help='Track file name')
+  ap.add_argument('--tracks', type=str, nargs='+', dest='trackFiles',
+      help='Track file names or glob patterns to evaluate as a batch against the same truth')
   ap.add_argument('--truth', type=str, dest='truthFile', help='Truth file name')
   ap.add_argument('--plots', type=str, dest='plotFile', help='Plot configuration file name')
+  ap.add_argument('--gate', type=str, dest='gateType', default='euclidean', choices=Associator.Associator.GATE_TYPES,
+      help='Association gate distance')
+  ap.add_argument('--assoc-mode', type=str, dest='assocMode', default='sparse', choices=Associator.Associator.MODES,
+      help='Solve gated clusters separately (sparse) or one full matrix per time (dense)')
+  ap.add_argument('--continuity-bonus', type=float, dest='continuityBonus', default=0.0,
+      help='Score reduction for a truth/track pair assigned at the previous time (sparse association only)')
+  ap.add_argument('--assoc-fields', type=str, nargs='+', dest='assocFields', default=['X', 'Y'],
+      help='Fields truth and tracks are compared on (Mahalanobis gating needs a SIGMA_<field> track field for each)')
+  ap.add_argument('--assoc-weights', type=float, nargs='+', dest='assocWeights', default=None,
+      help='Weight of each association field in the distance (default: 1 each)')
+  ap.add_argument('--gospa-cutoff', type=float, dest='gospaCutoff', default=None,
+      help='Distance cutoff of the gospa gate (default: the association gate)')
+  ap.add_argument('--gospa-order', type=float, dest='gospaOrder', default=2.0,
+      help='Power the distance is raised to by the gospa gate')
+  ap.add_argument('--workers', type=int, dest='numWorkers', default=1,
+      help='Number of processes to associate time steps with')
+  ap.add_argument('--chunk-size', type=int, dest='chunkSize', default=64,
+      help='Number of time steps handed to a worker process at once')
+  ap.add_argument('--interp', type=str, dest='interpMode', default='linear', choices=dm.DataManager.INTERP_MODES,
+      help='How truth is interpolated to the track times (streaming always interpolates linearly)')
+  ap.add_argument('--stream', action='store_true', dest='streaming',
+      help='Read time-ordered track and truth files in chunks instead of loading them (no report is generated)')
+  ap.add_argument('--pipeline', action='store_true', dest='pipeline',
+      help='Overlap reading the track file, association, figure rendering and pdflatex (the track file must be '
+      'in time order, and truth is interpolated linearly)')
+  ap.add_argument('--stream-chunk-rows', type=int, dest='streamChunkRows', default=100000,
+      help='Number of rows read at once when streaming')
+  ap.add_argument('--truth-lookahead', type=float, dest='truthLookahead', default=60.0,
+      help='Time window of truth samples kept around each track time when streaming')
+  ap.add_argument('--cache', type=str, dest='cacheMode', default='auto', choices=dm.DataManager.CACHE_MODES,
+      help='How the binary cache of parsed input files is used')
+  ap.add_argument('--cache-dir', type=str, dest='cacheDir', default=None,
+      help='Directory for the binary cache (default: next to each input file)')
+  ap.add_argument('--plot-workers', type=int, dest='plotWorkers', default=1,
+      help='Number of processes to render report figures with')
+  ap.add_argument('--no-figure-cache', action='store_false', dest='useFigureCache',
+      help='Render every figure, even those unchanged since the last run')
+  ap.add_argument('--report-format', type=str, dest='reportFormat', default='pdf',
+      choices=ReportGenerator.ReportGenerator.OUTPUT_FORMATS,
+      help='pdf or latex for the full report, json or html for only the summary numbers (no plots)')
+  ap.add_argument('--sections', type=str, nargs='+', dest='sections', default=None,
+      choices=ReportGenerator.ReportGenerator.SECTIONS, help='Report sections to write (default: all)')
+  ap.add_argument('--truth-ids', type=int, nargs='+', dest='truthIds', default=None,
+      help='Only report these truth IDs')
+  ap.add_argument('--track-ids', type=int, nargs='+', dest='trackIds', default=None,
+      help='Only report these track IDs')
+  ap.add_argument('--worst-tracks', type=int, dest='worstTracks', default=None,
+      help='Only report this many tracks, those with the largest mean assignment score')
+  ap.add_argument('--no-decimate', action='store_false', dest='decimate',
+      help='Plot every sample instead of reducing long series to the figure resolution')
+  ap.add_argument('--rasterize-markers', action='store_true', dest='rasterizeMarkers',
+      help='Draw marker-only series as bitmaps inside the vector figures')
+  ap.add_argument('--batch-workers', type=int, dest='batchWorkers', default=1,
+      help='Number of processes evaluating batch runs')
+  ap.add_argument('--batch-table', type=str, dest='batchTable', default='batchSiap.csv',
+      help='Comparative SIAP table written in batch mode')
+  ap.add_argument('--log-level', type=str, dest='logLevel', default='INFO',
+      choices=('DEBUG', 'INFO', 'WARNING', 'ERROR'), help='Console log level; DEBUG logs every assignment')
+  ap.add_argument('--metrics', type=str, dest='metricsFile', default=None,
+      help='File to write stage timings, counters and peak memory to (JSON if it ends in .json, else CSV)')
   opts = ap.parse_args()
-  dta = DataTruthAnalyzer(opts.trackFile, opts.truthFile)
-  #print('Track data:', dta.trackManager.idMapData)
-  #print('Truth data:', dta.truthManager.idMapData)
+  logging.basicConfig(level=getattr(logging, opts.logLevel), format='%(levelname)s %(name)s: %(message)s')
+  assocKwargs = {'gateType': opts.gateType, 'assocMode': opts.assocMode, 'continuityBonus': opts.continuityBonus,
+      'fields': opts.assocFields, 'weights': opts.assocWeights, 'gospaCutoff': opts.gospaCutoff,
+      'gospaOrder': opts.gospaOrder}
+  reportKwargs = {'outputFormat': opts.reportFormat, 'sections': opts.sections, 'truthIds': opts.truthIds,
+      'trackIds': opts.trackIds, 'worstTracks': opts.worstTracks, 'decimate': opts.decimate,
+      'rasterizeMarkers': opts.rasterizeMarkers}
+  if opts.trackFiles is not None:
+    # Imported here since BatchEvaluator builds on this module
+    import BatchEvaluator
+    be = BatchEvaluator.BatchEvaluator(opts.trackFiles, opts.truthFile, plotFile=opts.plotFile,
+        numWorkers=opts.batchWorkers, cacheMode=opts.cacheMode, cacheDir=opts.cacheDir,
+        analyzerKwargs=dict(assocKwargs, interpMode=opts.interpMode), reportKwargs=reportKwargs)
+    be.evaluate()
+    be.writeSiapTable(opts.batchTable)
+    exit(0)
+  if opts.pipeline:
+    # Imported here since PipelinedAnalyzer builds on this module
+    import PipelinedAnalyzer
+    pa = PipelinedAnalyzer.PipelinedAnalyzer(opts.trackFile, opts.truthFile, 'testReport', plotFile=opts.plotFile,
+        cacheMode=opts.cacheMode, cacheDir=opts.cacheDir, streamChunkRows=opts.streamChunkRows,
+        plotWorkers=opts.plotWorkers, useFigureCache=opts.useFigureCache, reportKwargs=reportKwargs, **assocKwargs)
+    pa.run()
+    pa.metrics.logSummary()
+    if opts.metricsFile is not None:
+      pa.metrics.write(opts.metricsFile)
+    exit(0)
+  dta = DataTruthAnalyzer(opts.trackFile, opts.truthFile, numWorkers=opts.numWorkers, chunkSize=opts.chunkSize,
+      streaming=opts.streaming, streamChunkRows=opts.streamChunkRows, truthLookahead=opts.truthLookahead,
+      cacheMode=opts.cacheMode, cacheDir=opts.cacheDir, interpMode=opts.interpMode, **assocKwargs)
   dta.assignTracksToTruth()
-  rg = ReportGenerator.ReportGenerator(dta, 'testReport', opts.plotFile)
-  rg.generateReport()
+  if opts.streaming:
+    # NaN when there is nothing to divide by, e.g. an empty run
+    logger.info('Completeness: %.3f%%', 100.0 * dta.siapTotals.getCompleteness())
+    logger.info('False track ratio: %.3f%%', 100.0 * dta.siapTotals.getFalseTrackRatio())
+    logger.info('Ambiguity: %.3f', dta.siapTotals.getAmbiguity())
+  else:
+    rg = ReportGenerator.ReportGenerator(dta, 'testReport', opts.plotFile, numWorkers=opts.plotWorkers,
+        useFigureCache=opts.useFigureCache, **reportKwargs)
+    rg.generateReport()
+  dta.metrics.logSummary()
+  if opts.metricsFile is not None:
+    dta.metrics.write(opts.metricsFile)
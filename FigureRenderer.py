@@ -0,0 +1,251 @@
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import json
+import logging
+import matplotlib as mat
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+import numpy
+import os
+import pickle
+
+logger = logging.getLogger(__name__)
+
+# Matplotlib format string characters that draw a marker, once any line style is taken out
+MARKER_CHARS = '.,ov^<>1234sp*hH+xXDd|_P8'
+LINE_STYLES = ('--', '-.', '-', ':')
+
+class FigureJob(object):
+  # Stands in for both the figure and its single axis while a report is written. The axis calls are
+  # recorded instead of drawn, so the figure can be rendered later in another process, and so its content
+  # can be hashed to tell whether it changed since the last run.
+  # With decimate set, series with more samples than the figure is pixels wide are reduced as they are
+  # recorded (see decimateLine and decimatePoints), so the size of the figure and its rendering time follow
+  # the figure's resolution rather than the data length. rasterizeMarkers draws marker-only series as a
+  # bitmap inside the vector file.
+
+  def __init__(self, axesKwargs, rc, decimate=False, rasterizeMarkers=False):
+    self.axesKwargs = axesKwargs
+    self.rc = rc
+    self.decimate = decimate
+    self.rasterizeMarkers = rasterizeMarkers
+    self.calls = []
+    self.fileName = None
+    self._pixelSize = None
+
+  def plot(self, *args, **kwargs):
+    if self.decimate and len(args) in (2, 3) and self._isLarge(args[0]):
+      hasLine, hasMarker = _getStyle(args[2] if len(args) == 3 else '', kwargs)
+      x, y = (numpy.asarray(arg, float) for arg in args[0:2])
+      width, height, cellSize = self._getPixelSize()
+      if hasLine:
+        keep = decimateLine(x, y, width, height)
+      elif hasMarker:
+        keep = decimatePoints(x, y, width, height, cellSize)
+        if self.rasterizeMarkers:
+          kwargs['rasterized'] = True
+      else:
+        keep = slice(None)
+      args = (x[keep], y[keep]) + args[2:]
+    self._record('plot', args, kwargs)
+
+  def errorbar(self, *args, **kwargs):
+    if self.decimate and len(args) == 2 and self._isLarge(args[0]):
+      # Besides the markers, the pixel columns keep the points whose error bars reach furthest
+      x, y = (numpy.asarray(arg, float) for arg in args)
+      width, height, cellSize = self._getPixelSize()
+      keep = decimatePoints(x, y, width, height, cellSize)
+      yerr = kwargs.get('yerr')
+      if yerr is not None and numpy.size(yerr) == len(x):
+        yerr = numpy.asarray(yerr, float)
+        columns = _getColumns(x, width)
+        finite = numpy.flatnonzero(numpy.isfinite(columns) & numpy.isfinite(y - yerr) & numpy.isfinite(y + yerr))
+        keep = numpy.union1d(keep, finite[_getGroupExtremes(columns[finite], (y - yerr)[finite])[0]])
+        keep = numpy.union1d(keep, finite[_getGroupExtremes(columns[finite], (y + yerr)[finite])[1]])
+      for key in ('xerr', 'yerr'):
+        if numpy.size(kwargs.get(key)) == len(x):
+          kwargs[key] = numpy.asarray(kwargs[key])[keep]
+      if self.rasterizeMarkers:
+        kwargs['rasterized'] = True
+      args = (x[keep], y[keep])
+    self._record('errorbar', args, kwargs)
+
+  def legend(self, *args, **kwargs):
+    self._record('legend', args, kwargs)
+
+  def set(self, **kwargs):
+    self._record('set', (), kwargs)
+
+  def _record(self, method, args, kwargs):
+    args = tuple(self._asArray(arg) for arg in args)
+    kwargs = {key: self._asArray(value) for key, value in kwargs.items()}
+    self.calls.append((method, args, kwargs))
+
+  def _asArray(self, value):
+    # Pandas series and memory-mapped columns are stored as plain arrays
+    if isinstance(value, numpy.ndarray) or hasattr(value, 'to_numpy'):
+      return numpy.asarray(value)
+    return value
+
+  def _isLarge(self, x):
+    return numpy.ndim(x) == 1 and numpy.size(x) > self._getPixelSize()[0]
+
+  def _getPixelSize(self):
+    # Figure width and height in pixels, and half a marker width, the size of the cells markers are thinned on
+    if self._pixelSize is None:
+      with mat.rc_context(self.rc):
+        dpi = mat.rcParams['figure.dpi']
+        width, height = (int(numpy.ceil(size * dpi)) for size in mat.rcParams['figure.figsize'])
+        cellSize = max(1.0, 0.5 * mat.rcParams['lines.markersize'] * dpi / 72.0)
+      self._pixelSize = (width, height, cellSize)
+    return self._pixelSize
+
+  def getHash(self):
+    return hashlib.sha1(pickle.dumps((self.axesKwargs, self.rc, self.calls), protocol=4)).hexdigest()
+
+
+def decimateLine(x, y, width, height):
+  # Returns the indices of the samples of a polyline worth drawing in a width x height pixel figure. The
+  # samples are split into runs that fall within one pixel, a pixel column if x is sorted (as in time
+  # histories) or one pixel of path length otherwise, and only the first and last sample and the x and y
+  # extremes of each run are kept, so the line drawn differs by less than a pixel. NaN samples that start a
+  # gap are kept so the line still breaks there.
+  finite = numpy.isfinite(x) & numpy.isfinite(y)
+  if not numpy.any(finite):
+    # Nothing is drawn, as when the plotted column has no values
+    return numpy.zeros(0, int)
+  if numpy.all(numpy.diff(x[finite]) >= 0):
+    bucket = _getColumns(x, width)
+  else:
+    px, py = _toPixels(x, finite, width), _toPixels(y, finite, height)
+    step = numpy.hypot(numpy.diff(px), numpy.diff(py))
+    bucket = numpy.floor(numpy.append(0.0, numpy.cumsum(numpy.where(numpy.isfinite(step), step, 0.0))))
+  prevFinite = numpy.append(False, finite[:-1])
+  newRun = finite & (numpy.logical_not(prevFinite) | numpy.append(True, bucket[1:] != bucket[:-1]))
+  run = numpy.cumsum(newRun)[finite]
+  idx = numpy.flatnonzero(finite)
+  keep = [numpy.flatnonzero(newRun), idx[numpy.append(run[1:] != run[:-1], True)],
+      numpy.flatnonzero(numpy.logical_not(finite) & prevFinite)]
+  for values in (x, y):
+    keep.extend(idx[extremes] for extremes in _getGroupExtremes(run, values[idx]))
+  return numpy.unique(numpy.concatenate(keep))
+
+def decimatePoints(x, y, width, height, cellSize):
+  # Returns the indices of the markers worth drawing in a width x height pixel figure: the first point in
+  # each cellSize x cellSize pixel cell, since markers closer than that overlap anyway
+  finite = numpy.isfinite(x) & numpy.isfinite(y)
+  numCols = int(numpy.ceil(width / cellSize)) + 1
+  cells = (numpy.floor(_toPixels(x, finite, width) / cellSize) +
+      numCols * numpy.floor(_toPixels(y, finite, height) / cellSize))
+  idx = numpy.flatnonzero(finite)
+  _, first = numpy.unique(cells[idx], return_index=True)
+  return numpy.sort(idx[first])
+
+def _getColumns(x, width):
+  return numpy.floor(_toPixels(x, numpy.isfinite(x), width))
+
+def _toPixels(values, finite, size):
+  # Scales the finite values onto [0, size] pixels (non-finite ones come out NaN)
+  pixels = numpy.full(len(values), numpy.nan)
+  if numpy.any(finite):
+    low = numpy.min(values[finite])
+    span = numpy.max(values[finite]) - low
+    pixels[finite] = (values[finite] - low) * (size / span if span > 0 else 0.0)
+  return pixels
+
+def _getGroupExtremes(group, values):
+  # Indices of the smallest and largest value of each group, for group numbers that never decrease
+  if len(group) == 0:
+    return (numpy.zeros(0, int), numpy.zeros(0, int))
+  order = numpy.lexsort((values, group))
+  last = numpy.append(group[order][1:] != group[order][:-1], True)
+  first = numpy.append(True, last[:-1])
+  return (order[first], order[last])
+
+def _getStyle(fmt, kwargs):
+  # Whether a plot call draws a line and whether it draws markers, from its format string and keywords
+  lineStyle = kwargs.get('linestyle', kwargs.get('ls'))
+  marker = kwargs.get('marker')
+  markerFmt = fmt
+  for style in LINE_STYLES:
+    markerFmt = markerFmt.replace(style, '')
+  hasMarker = any(char in MARKER_CHARS for char in markerFmt) if marker is None else marker not in ('None', 'none', '', ' ')
+  if lineStyle is not None:
+    hasLine = lineStyle not in ('None', 'none', '', ' ')
+  else:
+    hasLine = markerFmt != fmt or not hasMarker
+  return (hasLine, hasMarker)
+
+def renderFigure(job):
+  # Draws a recorded figure with the Agg canvas, which needs no display and is safe in worker processes
+  with mat.rc_context(job.rc):
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+    ax.set(**job.axesKwargs)
+    for method, args, kwargs in job.calls:
+      getattr(ax, method)(*args, **kwargs)
+    fig.savefig(job.fileName)
+  return job.fileName
+
+
+class FigureRenderer(object):
+  # Renders queued figure jobs, skipping those whose content hash matches the manifest from the last run
+  # and whose file still exists. With numWorkers > 1 the rest are rendered on a process pool. With useCache
+  # off every job is rendered, but the manifest is still written, so a later cached run knows what is on
+  # disk. Figures made in stages can instead be handed to an executor with submitPending as they are
+  # queued, followed by writeManifest once they are done.
+  MANIFEST = 'figureManifest.json'
+
+  def __init__(self, outDir, numWorkers=1, useCache=True):
+    self.outDir = outDir
+    self.numWorkers = numWorkers
+    self.useCache = useCache
+    self.manifestFile = os.path.join(outDir, self.MANIFEST)
+    self.jobs = []
+    self._manifest = None
+    self._hashes = {}
+
+  def add(self, job, fileName):
+    job.fileName = fileName
+    self.jobs.append(job)
+
+  def renderAll(self):
+    numJobs = len(self.jobs)
+    toRender = self._takeChanged()
+    logger.info('Rendering %d of %d figures', len(toRender), numJobs)
+    if self.numWorkers > 1 and len(toRender) > 1:
+      with ProcessPoolExecutor(max_workers=self.numWorkers) as executor:
+        chunkSize = max(1, len(toRender) // (4 * self.numWorkers))
+        list(executor.map(renderFigure, toRender, chunksize=chunkSize))
+    else:
+      for job in toRender:
+        renderFigure(job)
+    self.writeManifest()
+
+  def submitPending(self, executor):
+    # Starts rendering the changed jobs queued since the last call, returning their futures
+    return [executor.submit(renderFigure, job) for job in self._takeChanged()]
+
+  def writeManifest(self):
+    # Records the jobs taken so far as rendered
+    self._manifest.update(self._hashes)
+    self._hashes = {}
+    with open(self.manifestFile, 'w') as mf:
+      json.dump(self._manifest, mf, indent=1)
+
+  def _takeChanged(self):
+    # Empties the queue, returning the jobs that changed since the last run
+    if self._manifest is None:
+      self._manifest = {}
+      if self.useCache and os.path.isfile(self.manifestFile):
+        with open(self.manifestFile, 'r') as mf:
+          self._manifest = json.load(mf)
+    toRender = []
+    for job in self.jobs:
+      jobHash = job.getHash()
+      if self._manifest.get(job.fileName) != jobHash or not os.path.isfile(job.fileName):
+        toRender.append(job)
+      self._hashes[job.fileName] = jobHash
+    self.jobs = []
+    return toRender
@@ -0,0 +1,99 @@
+from collections import OrderedDict
+import contextlib
+import json
+import logging
+import os
+import sys
+import time
+try:
+  import resource
+except ImportError:
+  # Not available on Windows, where peak memory is simply not reported
+  resource = None
+
+logger = logging.getLogger(__name__)
+
+def getPeakMemory():
+  # Peak resident set size of this process so far, in bytes, or None where it can't be read
+  if resource is None:
+    return None
+  peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  # macOS reports bytes, Linux kilobytes
+  return peak if sys.platform == 'darwin' else 1024 * peak
+
+
+class Metrics(object):
+  # Collects what a run spent where: wall time and number of calls per named stage, counters sampled once
+  # per scan (kept as total, maximum and number of samples, so memory doesn't grow with the run) and the
+  # process's peak memory after each stage. Stage times are logged at info level as they finish.
+
+  def __init__(self):
+    self.stages = OrderedDict()
+    self.counters = OrderedDict()
+    self.peakMemory = OrderedDict()
+
+  @contextlib.contextmanager
+  def stage(self, name):
+    startTime = time.perf_counter()
+    yield
+    seconds = time.perf_counter() - startTime
+    self.addTime(name, seconds)
+    self.sampleMemory(name)
+    logger.info('%s took %.3f s', name, seconds)
+
+  def addTime(self, name, seconds, calls=1):
+    stage = self.stages.setdefault(name, [0.0, 0])
+    stage[0] += seconds
+    stage[1] += calls
+
+  def count(self, name, value):
+    counter = self.counters.setdefault(name, [0, 0, 0])
+    counter[0] += value
+    counter[1] = max(counter[1], value)
+    counter[2] += 1
+
+  def sampleMemory(self, label):
+    self.peakMemory[label] = getPeakMemory()
+
+  def getSeconds(self, name):
+    return self.stages[name][0] if name in self.stages else 0.0
+
+  def getSummary(self):
+    summary = OrderedDict()
+    summary['stages'] = OrderedDict((name, {'seconds': seconds, 'calls': calls})
+        for name, (seconds, calls) in self.stages.items())
+    summary['counters'] = OrderedDict((name, {'total': total, 'max': maxValue, 'samples': samples,
+        'mean': total / samples if samples > 0 else 0.0}) for name, (total, maxValue, samples) in self.counters.items())
+    summary['peakMemory'] = self.peakMemory
+    return summary
+
+  def logSummary(self, level=logging.INFO):
+    if not logger.isEnabledFor(level):
+      return
+    for name, (seconds, calls) in self.stages.items():
+      logger.log(level, 'Stage %s: %.3f s in %d calls', name, seconds, calls)
+    for name, (total, maxValue, samples) in self.counters.items():
+      logger.log(level, 'Counter %s: total %s, max %s per scan over %d scans', name, total, maxValue, samples)
+    if len(self.peakMemory) > 0 and None not in self.peakMemory.values():
+      logger.log(level, 'Peak memory: %.1f MB', max(self.peakMemory.values()) / 1.0E6)
+
+  def write(self, fileName):
+    # JSON if the name ends in .json, otherwise CSV with one kind,name,field,value row per number
+    summary = self.getSummary()
+    if fileName.endswith('.json'):
+      with open(fileName, 'w') as mf:
+        json.dump(summary, mf, indent=1, default=toJson)
+      return
+    with open(fileName, 'w') as mf:
+      mf.write('kind,name,field,value' + os.linesep)
+      for kind in ('stages', 'counters'):
+        for name, fields in summary[kind].items():
+          for field, value in fields.items():
+            mf.write('{0:s},{1:s},{2:s},{3:s}'.format(kind, name, field, str(value)) + os.linesep)
+      for label, value in summary['peakMemory'].items():
+        mf.write('peakMemory,{0:s},bytes,{1:s}'.format(label, str(value)) + os.linesep)
+
+def toJson(value):
+  # json.dump default for what it can't serialize itself: NumPy scalars, which end up in the counters and
+  # results, as their Python value and anything else as its string
+  return value.item() if hasattr(value, 'item') else str(value)
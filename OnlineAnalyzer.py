@@ -0,0 +1,40 @@
+import numpy
+
+import DataTruthAnalyzer
+
+class OnlineAnalyzer(DataTruthAnalyzer.DataTruthAnalyzer):
+  # Associates track reports as a tracker produces them, one scan at a time. Truth is loaded up front and
+  # interpolated to each scan's time on demand. With keepHistory set, scans must come in time order and go
+  # into the result store; with keepHistory=False only the running SIAP totals are kept, so memory stays flat
+  # during long soak tests.
+
+  def __init__(self, truthFile, gateType='euclidean', assocMode='sparse', keepHistory=True, cacheMode='auto',
+      cacheDir=None, **assocKwargs):
+    super().__init__(None, truthFile, gateType=gateType, assocMode=assocMode, cacheMode=cacheMode,
+        cacheDir=cacheDir, **assocKwargs)
+    self.keepHistory = keepHistory
+
+  def _loadData(self, trackFile, truthFile, cacheMode, cacheDir):
+    # Only truth is loaded, the tracks come in through pushScan
+    self.trackManager = None
+    with self.metrics.stage('loadTruth'):
+      self.truthManager = self._getManager(truthFile, cacheMode, cacheDir)
+
+  def pushScan(self, time, trkData):
+    # trkData is a dict of field -> array holding the track reports at this time, in any order. Reports with
+    # negative IDs are heartbeats and only mark the time. Returns the per-time summary of the assignment.
+    # The scan is checked before anything is updated, so a rejected scan leaves no trace.
+    if self.keepHistory:
+      self.results.checkTimeOrder(time)
+    ids = numpy.asarray(trkData['ID'])
+    order = numpy.argsort(ids, kind='stable')
+    order = order[ids[order] >= 0]
+    dup = numpy.flatnonzero(ids[order][1:] == ids[order][:-1])
+    if len(dup) > 0:
+      raise RuntimeError('Track', ids[order][dup[0]], 'has duplicate data at time', time)
+    thisTimeTrkData = {fld: numpy.asarray(fldData)[order] for fld, fldData in trkData.items()}
+    thisTimeTruthData = self.truthManager.getInterpolatedDataAtTime(time)
+    result = self.associator.associate(thisTimeTruthData, thisTimeTrkData)
+    thisTimeData = self._makeTimeData(thisTimeTruthData['ID'], thisTimeTrkData['ID'], result)
+    self._recordTimeData(time, thisTimeData)
+    return thisTimeData
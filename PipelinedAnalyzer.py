@@ -0,0 +1,180 @@
+import asyncio
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import copy
+import logging
+import multiprocessing
+import numpy
+import subprocess
+import time
+
+import DataManager as dm
+import OnlineAnalyzer
+import ReportGenerator
+import StreamingReader
+
+logger = logging.getLogger(__name__)
+
+class PipelinedAnalyzer(OnlineAnalyzer.OnlineAnalyzer):
+  # Runs a whole analysis with its stages overlapping instead of one after the other:
+  #   - the track file is parsed in chunks on a thread while the scans already read are associated, and
+  #     truth is loaded on another thread meanwhile
+  #   - once the whole track file is read (so every ID's last time is known), the report section of each
+  #     truth and track is made as soon as its last time has been associated, and its figures are rendered
+  #     on a process pool while association goes on
+  #   - pdflatex runs as a subprocess of the event loop once the figures are done
+  # As when streaming, the track file must be in time order, and truth is interpolated linearly to each scan.
+  # Making a section needs the results' ID index rebuilt, so retired IDs are handled in batches, each once
+  # the results have grown by RETIRE_GROWTH since the last.
+  RETIRE_GROWTH = 0.125
+
+  def __init__(self, trackFile, truthFile, baseName, plotFile=None, gateType='euclidean', assocMode='sparse',
+      cacheMode='auto', cacheDir=None, streamChunkRows=100000, plotWorkers=1, useFigureCache=True,
+      reportKwargs=None, **assocKwargs):
+    super().__init__(truthFile, gateType=gateType, assocMode=assocMode, keepHistory=True, cacheMode=cacheMode,
+        cacheDir=cacheDir, **assocKwargs)
+    self.trackFile = trackFile
+    self.baseName = baseName
+    self.plotFile = plotFile
+    self.streamChunkRows = streamChunkRows
+    self.plotWorkers = plotWorkers
+    self.useFigureCache = useFigureCache
+    self.reportKwargs = dict(reportKwargs or {})
+
+  def _loadData(self, trackFile, truthFile, cacheMode, cacheDir):
+    # Nothing is loaded yet: run reads the track file and loads truth while associating
+    self.truthFile = truthFile
+    self.cacheMode = cacheMode
+    self.cacheDir = cacheDir
+    self.trackManager = None
+    self.truthManager = None
+
+  def run(self):
+    with self.metrics.stage('pipeline'):
+      asyncio.run(self._run())
+
+  async def _run(self):
+    loop = asyncio.get_running_loop()
+    scans = asyncio.Queue()
+    readTask = loop.run_in_executor(None, self._readTracks, loop, scans)
+    self.truthManager = await loop.run_in_executor(None, self._loadTruth)
+    self.associator.resetContinuity()
+    self._retiring = deque()
+    self._retired = []
+    self._retiredAtEvents = 0
+    self._truthSections = {}
+    self._trackSections = {}
+    self._figures = []
+    reportTask = None
+    rg = None
+    # Worker processes are spawned rather than forked, since the reader thread may be running
+    with ProcessPoolExecutor(max_workers=self.plotWorkers, mp_context=multiprocessing.get_context('spawn')) as executor:
+      while True:
+        scan = await scans.get()
+        if scan is None:
+          break
+        startTime = time.perf_counter()
+        self.pushScan(*scan)
+        self.metrics.addTime('associate', time.perf_counter() - startTime)
+        if reportTask is None and readTask.done():
+          reportTask = loop.run_in_executor(None, self._startReport, readTask.result())
+        if rg is None and reportTask is not None and reportTask.done():
+          rg = reportTask.result()
+        if rg is not None:
+          self._retire(rg, executor, scan[0], force=False)
+
+      if reportTask is None:
+        reportTask = loop.run_in_executor(None, self._startReport, await readTask)
+      rg = await reportTask
+      if rg.outputFormat in rg.SUMMARY_FORMATS:
+        rg.generateReport()
+        return
+      self._retire(rg, executor, numpy.inf, force=True)
+      with self.metrics.stage('report.latex'):
+        rg.writeLatex(self._truthSections, self._trackSections)
+      self._figures.extend(rg.figureRenderer.submitPending(executor))
+      with self.metrics.stage('report.figures'):
+        await asyncio.gather(*[asyncio.wrap_future(future) for future in self._figures])
+        rg.figureRenderer.writeManifest()
+    if rg.outputFormat == 'pdf':
+      with self.metrics.stage('report.pdflatex'):
+        await self._compilePdf(rg)
+
+  def _loadTruth(self):
+    with self.metrics.stage('loadTruth'):
+      return self._getManager(self.truthFile, self.cacheMode, self.cacheDir)
+
+  def _readTracks(self, loop, scans):
+    # Runs on a thread, handing each scan to the event loop as it is parsed. The scans are also kept, and
+    # become the track data of the report once the file is done.
+    startTime = time.perf_counter()
+    reader = StreamingReader.StreamingReader(self.trackFile, hasId=True, chunkRows=self.streamChunkRows)
+    times = []
+    allData = []
+    try:
+      for scanTime, trkData in reader:
+        loop.call_soon_threadsafe(scans.put_nowait, (scanTime, trkData))
+        times.append(scanTime)
+        allData.append(trkData)
+    finally:
+      # The end is always signalled, so a failed read surfaces when the reader is awaited
+      loop.call_soon_threadsafe(scans.put_nowait, None)
+    if len(allData) == 0:
+      raise RuntimeError('No track data in ' + str(self.trackFile))
+    columns = {fld: numpy.concatenate([trkData[fld] for trkData in allData]) for fld in allData[0].keys()}
+    trackManager = dm.DataManager.fromColumns(columns, reader.getTimeField(), numpy.array(times))
+    return (trackManager, time.perf_counter() - startTime)
+
+  def _startReport(self, readResult):
+    # Runs on a thread once the track file is read. Truth for the report is resampled to the track times on
+    # a copy, since association goes on interpolating the loaded truth, and the IDs whose sections can be
+    # made early are queued by their last time.
+    self.trackManager, readSeconds = readResult
+    self.metrics.addTime('readTrack', readSeconds)
+    reportTruth = self.truthManager.copy()
+    reportTruth.interpolateToTimeAxis(self.trackManager.getUniqueTimes())
+    reportView = copy.copy(self)
+    reportView.truthManager = reportTruth
+    rg = ReportGenerator.ReportGenerator(reportView, self.baseName, self.plotFile, numWorkers=self.plotWorkers,
+        useFigureCache=self.useFigureCache, **self.reportKwargs)
+    if rg.outputFormat in rg.SUMMARY_FORMATS:
+      return rg
+    retiring = []
+    for kind, manager, wantsSection in (('truth', reportTruth, rg.wantsTruthSection),
+        ('track', self.trackManager, rg.wantsTrackSection)):
+      for id, data in manager.idMapData.items():
+        times = data[manager._timeField]
+        if len(times) > 0 and wantsSection(id):
+          retiring.append((times[-1], kind, id))
+    retiring.sort()
+    self._retiring = deque(retiring)
+    return rg
+
+  def _retire(self, rg, executor, upToTime, force):
+    # Makes the sections of the IDs whose last time is at or before upToTime and starts on their figures
+    while len(self._retiring) > 0 and self._retiring[0][0] <= upToTime:
+      self._retired.append(self._retiring.popleft())
+    if len(self._retired) == 0:
+      return
+    if not force and self.results.numEvents < (1.0 + self.RETIRE_GROWTH) * self._retiredAtEvents:
+      return
+    for lastTime, kind, id in self._retired:
+      if kind == 'truth':
+        self._truthSections[id] = rg.makeTruthSection(id)
+      else:
+        self._trackSections[id] = rg.makeTrackSection(id)
+    logger.debug('Made report sections of %d IDs', len(self._retired))
+    self._retired = []
+    self._retiredAtEvents = self.results.numEvents
+    self._figures.extend(rg.figureRenderer.submitPending(executor))
+
+  async def _compilePdf(self, rg):
+    try:
+      process = await asyncio.create_subprocess_exec(*rg.getCompileCommand(), stdin=subprocess.DEVNULL,
+          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    except FileNotFoundError:
+      logger.warning('pdflatex not found, %s.tex is left uncompiled', rg.baseName)
+      return
+    returnCode = await process.wait()
+    if returnCode != 0:
+      logger.warning('pdflatex failed on %s.tex with status %d', rg.baseName, returnCode)
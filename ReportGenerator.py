@@ -1,25 +1,66 @@
 import collections
+import html
+import io
+import json
+import logging
 import matplotlib as mat
 import matplotlib.pyplot as plt
 import numpy
 import os
+import subprocess
+
+import FigureRenderer
+import SiapMetrics
+
+logger = logging.getLogger(__name__)
 
 class ReportGenerator(object):
+  SECTIONS = ('siap', 'truthSummary', 'truthAssignments', 'trackAssignments')
+  OUTPUT_FORMATS = ('pdf', 'latex', 'json', 'html')
+  SUMMARY_FORMATS = ('json', 'html')
 
-  def __init__(self, dataTruthAnalyzer, baseName, plotFile):
+  def __init__(self, dataTruthAnalyzer, baseName, plotFile=None, numWorkers=1, useFigureCache=True,
+      outputFormat='pdf', sections=None, truthIds=None, trackIds=None, worstTracks=None, decimate=True,
+      rasterizeMarkers=False):
+    # outputFormat is one of:
+    #   pdf: the LaTeX report with its figures, compiled with pdflatex
+    #   latex: the same, left uncompiled
+    #   json, html: only the summary numbers (overall SIAP metrics, per-target and per-track tables), with
+    #               no figures or plot file needed
+    # sections, truthIds and trackIds select what is reported (default: everything), and worstTracks keeps
+    # only that many of the selected tracks, those with the largest mean assignment score.
+    # decimate reduces long series to what the figure resolution can show, and rasterizeMarkers draws
+    # marker-only series as bitmaps (see FigureRenderer.FigureJob).
+    if outputFormat not in self.OUTPUT_FORMATS:
+      raise RuntimeError('Unknown report format: ' + str(outputFormat))
+    self.sections = self.SECTIONS if sections is None else tuple(sections)
+    for section in self.sections:
+      if section not in self.SECTIONS:
+        raise RuntimeError('Unknown report section: ' + str(section))
     self.dta = dataTruthAnalyzer
     self.baseName = baseName
+    self.outputFormat = outputFormat
+    self.truthIds = None if truthIds is None else set(truthIds)
+    self.trackIds = None if trackIds is None else set(trackIds)
+    self.worstTracks = worstTracks
+    self.plotFile = plotFile
+    self.decimate = decimate
+    self.rasterizeMarkers = rasterizeMarkers
+    self.plotDict = collections.OrderedDict()
+    if outputFormat in self.SUMMARY_FORMATS:
+      return
     self.outDir = self.baseName + 'Plots'
     os.makedirs(self.outDir, exist_ok=True)
+    # Figures are queued while the LaTeX is written and rendered together once it is done
+    self.figureRenderer = FigureRenderer.FigureRenderer(self.outDir, numWorkers=numWorkers, useCache=useFigureCache)
     self._setupPlotDefaults()
-    self.plotFile = plotFile
-    self._setupPlots()
+    if plotFile is not None:
+      self._setupPlots()
 
   def _setupPlots(self):
-    self.plotDict = collections.OrderedDict()
     with open(self.plotFile, 'r') as pf:
       for line in pf.readlines():
-        print('Line:', line)
+        logger.debug('Line: %s', line)
         splitLine = line.strip().split(':')
         cat = splitLine[0]
         x = splitLine[1]
@@ -28,34 +69,156 @@ class ReportGenerator(object):
         plotList.append((x, y))
         self.plotDict[cat] = plotList
 
-    print(self.plotDict)
+    logger.debug('%s', self.plotDict)
 
   def _setupPlotDefaults(self):
-    p = mat.rcParams
-    p.update({'xtick.labelsize': 'large'})
-    p.update({'ytick.labelsize': 'large'})
-    p.update({'axes.labelsize': 'large'})
-    p.update({'axes.linewidth': 2.5})
-    p.update({'axes.titlesize': 'x-large'})
-    p.update({'axes.titleweight': 'bold'})
-    p.update({'axes.xmargin': 0.01})
-    p.update({'axes.ymargin': 0.01})
-    p.update({'lines.linewidth': 2.5})
-    p.update({'lines.markersize': 8.0})
-    p.update({'markers.fillstyle': 'full'})
-    p.update({'legend.markerscale': 2.0})
-    p.update({'legend.numpoints': 1})
+    # Kept with each figure job as well, since worker processes don't share this process's rcParams
+    self.plotRc = {
+      'xtick.labelsize': 'large',
+      'ytick.labelsize': 'large',
+      'axes.labelsize': 'large',
+      'axes.linewidth': 2.5,
+      'axes.titlesize': 'x-large',
+      'axes.titleweight': 'bold',
+      'axes.xmargin': 0.01,
+      'axes.ymargin': 0.01,
+      'lines.linewidth': 2.5,
+      'lines.markersize': 8.0,
+      'markers.fillstyle': 'full',
+      'legend.markerscale': 2.0,
+      'legend.numpoints': 1,
+    }
+    mat.rcParams.update(self.plotRc)
     self.defaultLineCycler = plt.cycler('color', ('#0000dd', '#dd0000', '#00dd00', '#ddaa00', '#000000', '#00dddd'))
 
   def generateReport(self):
+    metrics = self.dta.metrics
+    if self.outputFormat in self.SUMMARY_FORMATS:
+      self.siap = SiapMetrics.SiapMetrics(self.dta.results)
+      with metrics.stage('report.summary'):
+        self._writeSummary()
+      return
+    with metrics.stage('report.latex'):
+      self.writeLatex()
+    with metrics.stage('report.figures'):
+      self.figureRenderer.renderAll()
+    if self.outputFormat == 'pdf':
+      with metrics.stage('report.pdflatex'):
+        self._compilePdf()
+
+  def writeLatex(self, truthSections=None, trackSections=None):
+    # Writes the .tex file and queues its figures. Per-truth and per-track sections made ahead of time with
+    # makeTruthSection and makeTrackSection can be given as dicts of ID -> LaTeX; the rest are made here.
+    self.siap = SiapMetrics.SiapMetrics(self.dta.results)
+    truthSections = truthSections or {}
+    trackSections = trackSections or {}
     with open(self.baseName+'.tex', 'w') as self.latexFile:
       self._makeHeader()
-      self._makeSiapMetrics(self.dta.allTimeData)
-      self._makeTruthSummary(self.dta.truthManager)
-      self._makeTruthAssignmentSummary()
-      self._makeTrackAssignmentSummary()
+      if 'siap' in self.sections:
+        self._makeSiapMetrics(self.siap)
+      if 'truthSummary' in self.sections:
+        self._makeTruthSummary(self.dta.truthManager)
+      if 'truthAssignments' in self.sections:
+        self.write('\\pagebreak')
+        self.write('\\section{Truth Assignments}')
+        for truthId in self._getTruthIds():
+          self.latexFile.write(truthSections[truthId] if truthId in truthSections else self.makeTruthSection(truthId))
+      if 'trackAssignments' in self.sections:
+        self.write('\\pagebreak')
+        self.write('\\section{Track Assignments}')
+        for trkId in self._getTrackIds():
+          self.latexFile.write(trackSections[trkId] if trkId in trackSections else self.makeTrackSection(trkId))
       self._makeFooter()
-    os.system(' '.join(('pdflatex', self.baseName+'.tex', '>', '/dev/null')))
+
+  def wantsTruthSection(self, truthId):
+    return 'truthAssignments' in self.sections and (self.truthIds is None or truthId in self.truthIds)
+
+  def wantsTrackSection(self, trkId):
+    # The worst tracks are only known once every time is associated, so their sections can't be made early
+    return ('trackAssignments' in self.sections and self.worstTracks is None and
+        (self.trackIds is None or trkId in self.trackIds))
+
+  def makeTruthSection(self, truthId):
+    # The LaTeX of one truth's assignment section, which only needs that truth's times to be associated
+    return self._capture(self._makeTruthAssignments, truthId)
+
+  def makeTrackSection(self, trkId):
+    return self._capture(self._makeTrackAssignments, trkId)
+
+  def _capture(self, method, *args):
+    # Runs a section writer into a string instead of the .tex file
+    latexFile = getattr(self, 'latexFile', None)
+    self.latexFile = io.StringIO()
+    try:
+      method(*args)
+      return self.latexFile.getvalue()
+    finally:
+      self.latexFile = latexFile
+
+  def getCompileCommand(self):
+    return ['pdflatex', '-interaction=nonstopmode', self.baseName + '.tex']
+
+  def _compilePdf(self):
+    texFile = self.baseName + '.tex'
+    try:
+      completed = subprocess.run(self.getCompileCommand(), stdin=subprocess.DEVNULL,
+          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    except FileNotFoundError:
+      logger.warning('pdflatex not found, %s is left uncompiled', texFile)
+      return
+    if completed.returncode != 0:
+      logger.warning('pdflatex failed on %s with status %d', texFile, completed.returncode)
+
+  def _getTruthIds(self):
+    return [truthId for truthId in self.dta.truthManager.idMapData.keys()
+        if self.truthIds is None or truthId in self.truthIds]
+
+  def _getTrackIds(self):
+    trkIds = [trkId for trkId in self.dta.trackManager.idMapData.keys()
+        if self.trackIds is None or trkId in self.trackIds]
+    if self.worstTracks is None:
+      return trkIds
+    perTrack = self.siap.getPerTrack()
+    meanScores = dict(zip(perTrack['trkId'].tolist(), perTrack['meanScore'].tolist()))
+    # Tracks never assigned have no score and are left out
+    scored = [trkId for trkId in trkIds if not numpy.isnan(meanScores.get(trkId, numpy.nan))]
+    worst = set(sorted(scored, key=lambda trkId: meanScores[trkId], reverse=True)[0:self.worstTracks])
+    return [trkId for trkId in trkIds if trkId in worst]
+
+  def _getSummary(self):
+    # The numbers of the report, restricted to the selected truths and tracks, as plain lists (NaN as None)
+    truthIds = self._getTruthIds()
+    trkIds = self._getTrackIds()
+    perTarget = self.siap.getPerTarget()
+    perTrack = self.siap.getPerTrack()
+    targetRows = numpy.isin(perTarget['truthId'], truthIds)
+    trackRows = numpy.isin(perTrack['trkId'], trkIds)
+    summary = collections.OrderedDict()
+    summary['name'] = self.baseName
+    summary['numTimes'] = self.dta.results.numTimes
+    summary['overall'] = collections.OrderedDict((key, _toJsonValue(value)) for key, value in self.siap.getOverall().items())
+    summary['overall']['numSwitches'] = int(numpy.sum(perTarget['numSwitches']))
+    summary['overall']['numSegments'] = int(numpy.sum(perTarget['numSegments']))
+    summary['perTarget'] = collections.OrderedDict((key, [_toJsonValue(value) for value in values[targetRows]])
+        for key, values in perTarget.items())
+    summary['perTrack'] = collections.OrderedDict((key, [_toJsonValue(value) for value in values[trackRows]])
+        for key, values in perTrack.items())
+    return summary
+
+  def _writeSummary(self):
+    summary = self._getSummary()
+    if self.outputFormat == 'json':
+      with open(self.baseName + '.json', 'w') as jf:
+        json.dump(summary, jf, indent=1)
+      return
+    with open(self.baseName + '.html', 'w') as hf:
+      hf.write('<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>{0:s}</title></head><body>\n'.format(
+          html.escape(self.baseName)))
+      hf.write('<h1>{0:s}</h1>\n<h2>SIAP Metrics</h2>\n'.format(html.escape(self.baseName)))
+      hf.write(_htmlTable(collections.OrderedDict((key, [value]) for key, value in summary['overall'].items())))
+      hf.write('<h2>Truth Objects</h2>\n' + _htmlTable(summary['perTarget']))
+      hf.write('<h2>Tracks</h2>\n' + _htmlTable(summary['perTrack']))
+      hf.write('</body></html>\n')
 
   def write(self, *args):
     strToWrite = ' '.join([str(arg) for arg in args])
@@ -69,7 +232,7 @@ class ReportGenerator(object):
     self.write('\\evensidemargin=-0.25in' + os.linesep)
     self.write('\\oddsidemargin=-0.25in' + os.linesep)
     self.write(''.join(('\\title{', self.baseName, '}')))
-    self.write(''.join(('\\author{', os.getenv('USER'), '}')))
+    self.write(''.join(('\\author{', os.getenv('USER', ''), '}')))
     self.write('\\begin{document}')
     self.write('\\begin{abstract}')
     self.write('This is an automated report.')
@@ -79,16 +242,13 @@ class ReportGenerator(object):
   def _makeFooter(self):
     self.write('\\end{document}')
 
-  def _makeSiapMetrics(self, allTimeData):
+  def _makeSiapMetrics(self, siap):
     self.write('\\pagebreak')
     self.write('\\section{Single Integrated Air Picture (SIAP) Metrics}')
     
-    # Grab values out of the allTimeData that we need for the different calculation.
-    times = numpy.array([k for k in allTimeData.keys()])
-    numAssigned = numpy.array([d['numAssignedTrks'] for d in allTimeData.values()], float)
-    numAssoc = numpy.array([d['numAssociatedTrks'] for d in allTimeData.values()], float)
-    numTruth = numpy.array([len(d['validTruthIds']) for d in allTimeData.values()], float)
-    numTrksTotal = numpy.array([len(d['validTrkIds']) for d in allTimeData.values()], float)
+    overall = siap.getOverall()
+    perTime = siap.getPerTime()
+    times = perTime['time']
     # Completeness
     self.write('\\subsection{Completeness}')
     self.write('Completeness is the ratio of the number of tracks assigned to truth objects ("good tracks") to',
@@ -97,13 +257,10 @@ class ReportGenerator(object):
     self.write('C_{t} = \\frac{N_{trk, assigned}^{t}}{N_{tgt}^{t}} \\\\')
     self.write('C = \\frac{\\sum_{t}^{}{N_{trk, assigned}^{t}}}{\\sum_{t}^{}{N_{tgt}^{t}}}')
     self.write('\\end{eqnarray*}')
-    #print('numAssigned', numAssigned)
-    #print('numTruth', numTruth)
-    completeness = sum(numAssigned) / sum(numTruth)
-    self.write('The overall completess is:', '{0:.3f}\\%.'.format(100.0*completeness))
+    self.write('The overall completess is:', '{0:.3f}\\%.'.format(100.0*overall['completeness']))
     fig, ax = self._getSingleAxisFigure(xlabel='Time', ylabel='Completeness', title='Completeness Over Time')
-    print('times:', times, 'shape:', numpy.shape(times))
-    ax.plot(times, 100.0 * numAssigned / numTruth, 'bo')
+    logger.debug('times: %s shape: %s', times, numpy.shape(times))
+    ax.plot(times, 100.0 * perTime['completeness'], 'bo')
     ax.plot(times, 100.0 * numpy.ones(numpy.shape(times)), 'g:')
     ax.plot(times, numpy.zeros(numpy.shape(times)), 'r:')
     ax.set(ylim=(-5., 105.))
@@ -119,12 +276,9 @@ class ReportGenerator(object):
     self.write('FTR_{t} = \\frac{N_{trk, total}^{t} - N_{trk, assoc}^{t}}{N_{trk, total}^{t}} \\\\')
     self.write('FTR = \\frac{\\sum_{t}^{}{N_{trk, total}^{t} - N_{trk, assoc}^{t}}}{\\sum_{t}^{}{N_{trk, total}^{t}}}')
     self.write('\\end{eqnarray*}')
-    #print('numAssoc', numAssoc)
-    #print('numTotal', numTrksTotal)
-    ftr = sum(numTrksTotal - numAssoc) / sum(numTrksTotal)
-    self.write('The overall false track ratio is:', '{0:.3f}\\%.'.format(100.0*ftr))
+    self.write('The overall false track ratio is:', '{0:.3f}\\%.'.format(100.0*overall['falseTrackRatio']))
     fig, ax = self._getSingleAxisFigure(xlabel='Time', ylabel='FTR', title='False Track Ratio Over Time')
-    ax.plot(times, 100.0 * (numTrksTotal - numAssoc) / numTrksTotal, 'bo')
+    ax.plot(times, 100.0 * perTime['falseTrackRatio'], 'bo')
     ax.plot(times, 100.0 * numpy.ones(numpy.shape(times)), 'g:')
     ax.plot(times, numpy.zeros(numpy.shape(times)), 'r:')
     ax.set(ylim=(-5., 105.))
@@ -138,38 +292,47 @@ class ReportGenerator(object):
     self.write('A{t} = \\frac{N_{trk, assoc}^{t}}{N_{trk, assigned}^{t}} \\\\')
     self.write('A = \\frac{\\sum_{t}^{}{N_{trk, assoc}^{t}}}{\\sum_{t}^{}{N_{trk, assigned}^{t}}}')
     self.write('\\end{eqnarray*}')
-    #print('numAssoc', numAssoc)
-    #print('numAssigned', numAssigned)
-    amb = sum(numAssoc) / sum(numAssigned)
-    self.write('The overall ambiguity is:', '{0:.3f}.'.format(amb))
+    self.write('The overall ambiguity is:', '{0:.3f}.'.format(overall['ambiguity']))
     fig, ax = self._getSingleAxisFigure(xlabel='Time', ylabel='Ambiguity', title='Ambiguity Over Time')
-    ax.plot(times, numAssoc / numAssigned, 'bo')
+    ax.plot(times, perTime['ambiguity'], 'bo')
     ax.plot(times, 1.0 * numpy.ones(numpy.shape(times)), 'g:')
     ax.plot(times, numpy.zeros(numpy.shape(times)), 'r:')
     self._addFigures([fig], ['siapAmbiguity.pdf'], 1)
 
+    # Track continuity
+    perTarget = siap.getPerTarget()
+    self.write('\\subsection{Track Continuity}')
+    self.write('A track switch is a change of the track assigned to a truth object between two times at which it is assigned.',
+        'A segment is a run of consecutive times over which a truth object keeps the same assigned track.')
+    self.write('Over all truth objects there are', str(numpy.sum(perTarget['numSwitches'])), 'track switches and',
+        str(numpy.sum(perTarget['numSegments'])), 'segments.')
+
   def _makeTruthSummary(self, truthManager):
     # Geometry for all truth objects together
     self.write('\\pagebreak')
     self.write('\\section{Truth Summary}')
     self.write('\\subsection{Overall Truth Geometry}')
     fig, ax = self._getSingleAxisFigure(xlabel='X', ylabel='Y', title='Overall Geometry', prop_cycle=self.defaultLineCycler)
-    for truthId, truthData in truthManager.idMapData.items():
+    truthIds = self._getTruthIds()
+    for truthId in truthIds:
+      truthData = truthManager.idMapData[truthId]
       xAxis, yAxis = ('X', 'Y')
       ax.plot(truthData[xAxis], truthData[yAxis], '-', label=str(truthId))
       log = numpy.logical_not(numpy.logical_or(numpy.isnan(truthData[xAxis]), numpy.isnan(truthData[yAxis])))
-      print(log)
-      idx = numpy.squeeze(numpy.where(log))
+      logger.debug('%s', log)
+      idx = numpy.flatnonzero(log)
       #print('idx:', idx)
-      ax.plot(truthData[xAxis][idx[0]], truthData[yAxis][idx[0]], 'go', label=None)
-      ax.plot(truthData[xAxis][idx[-1]], truthData[yAxis][idx[-1]], 'ro', label=None)
+      if len(idx) > 0:
+        ax.plot(truthData[xAxis][idx[0]], truthData[yAxis][idx[0]], 'go', label=None)
+        ax.plot(truthData[xAxis][idx[-1]], truthData[yAxis][idx[-1]], 'ro', label=None)
     ax.legend()
     self._addFigures([fig], ['truthOverallGeometry.pdf'], 1)
-    for truthId, truthData in truthManager.idMapData.items():
+    for truthId in truthIds:
+      truthData = truthManager.idMapData[truthId]
       self.write('\\subsection{Summary for truth: ' + str(truthId) + '}')
       figs = []
       names = []
-      for plotDims in self.plotDict['TRUTH']:
+      for plotDims in self.plotDict.get('TRUTH', []):
         xAxis = self.dta.truthManager._timeField if plotDims[0] == 'T' else plotDims[0]
         yAxis = self.dta.truthManager._timeField if plotDims[1] == 'T' else plotDims[1]
         fig, ax = self._getSingleAxisFigure(xlabel=xAxis,
@@ -180,42 +343,36 @@ class ReportGenerator(object):
         ax.plot(truthData[xAxis], truthData[yAxis], 'b-')
       self._addFigures(figs, names, 2)
 
-  def _makeTrackAssignmentSummary(self):
-    self.write('\\pagebreak')
-    self.write('\\section{Track Assignments}')
-    times = self.dta.allTimeData.keys()
-    allTrackIds = self.dta.trackManager.idMapData.keys()
-    for iTrk, trkId in enumerate(allTrackIds):
-      self.write('\\subsection{Track', trkId, 'Assignments}')
-      #print('Looking at track', trkId)
-      truthAssignments = self.dta.trackAssignments[trkId]
-      truthAssignmentIds = numpy.array(truthAssignments['TRUTH_IDS'])
-      self.write('Track', trkId, 'assigned to truths:', truthAssignmentIds, '\\\\')
-      idx = numpy.where(truthAssignmentIds >= 0)
-      if numpy.size(idx) > 0:
-        validTruthAssignments = truthAssignmentIds[idx]
-        (uTruth, count) = numpy.unique(validTruthAssignments, return_counts=True)
-        bestAssignedTruth = uTruth[numpy.argmax(count)]
-        self.write('Track', trkId, 'best assigned truth:', bestAssignedTruth, os.linesep)
-        (uTruth, count) = numpy.unique(truthAssignmentIds, return_counts=True)
-        fig, ax = self._getSingleAxisFigure(xlabel='Time', ylabel='Assigned Truth', title='Track ' + str(trkId) + ' Assignments')
-        for iUTruth, truthId in enumerate(uTruth):
-          idx = numpy.squeeze(numpy.where(truthAssignmentIds == truthId))
-          #print('trackAssignments:', trackAssignments)
-          #print('idx:', idx, ' for truthId:', truthId)
-          #print(validTimes)
-          ax.plot(numpy.array(truthAssignments['TIME'])[idx], iUTruth * numpy.ones(numpy.shape(idx)), 's')
-        ax.set(ylim=(-0.1, len(uTruth) - 0.9))
-        ax.set(yticks=range(0, len(uTruth)), yticklabels=[str(truth) if truth >= 0 else 'Unassigned' for truth in uTruth])
-        self._addFigures([fig], [''.join(('track', str(trkId), 'Assignments.pdf'))], 1)
-        self._makeAssignedTrackAndTruthPlots(trkId, bestAssignedTruth)
-      else:
-        self.write('Track', trkId, 'never assigned to truth.', os.linesep)
-      #print('Done with track', trkId)
+  def _makeTrackAssignments(self, trkId):
+    self.write('\\subsection{Track', trkId, 'Assignments}')
+    #print('Looking at track', trkId)
+    assignmentTimes, truthAssignmentIds, _ = self.dta.results.getTrackHistory(trkId)
+    self.write('Track', trkId, 'assigned to truths:', truthAssignmentIds, '\\\\')
+    idx = numpy.where(truthAssignmentIds >= 0)
+    if numpy.size(idx) > 0:
+      validTruthAssignments = truthAssignmentIds[idx]
+      (uTruth, count) = numpy.unique(validTruthAssignments, return_counts=True)
+      bestAssignedTruth = uTruth[numpy.argmax(count)]
+      self.write('Track', trkId, 'best assigned truth:', bestAssignedTruth, os.linesep)
+      (uTruth, count) = numpy.unique(truthAssignmentIds, return_counts=True)
+      fig, ax = self._getSingleAxisFigure(xlabel='Time', ylabel='Assigned Truth', title='Track ' + str(trkId) + ' Assignments')
+      for iUTruth, truthId in enumerate(uTruth):
+        idx = numpy.squeeze(numpy.where(truthAssignmentIds == truthId))
+        #print('trackAssignments:', trackAssignments)
+        #print('idx:', idx, ' for truthId:', truthId)
+        #print(validTimes)
+        ax.plot(assignmentTimes[idx], iUTruth * numpy.ones(numpy.shape(idx)), 's')
+      ax.set(ylim=(-0.1, len(uTruth) - 0.9))
+      ax.set(yticks=range(0, len(uTruth)), yticklabels=[str(truth) if truth >= 0 else 'Unassigned' for truth in uTruth])
+      self._addFigures([fig], [''.join(('track', str(trkId), 'Assignments.pdf'))], 1)
+      self._makeAssignedTrackAndTruthPlots(trkId, bestAssignedTruth)
+    else:
+      self.write('Track', trkId, 'never assigned to truth.', os.linesep)
+    #print('Done with track', trkId)
 
   def _makeAssignedTrackAndTruthPlots(self, trkId, truthId):
     # Straight comparisons
-    plotDims = self.plotDict['TRACK']
+    plotDims = self.plotDict.get('TRACK', [])
     figs = []
     names = []
     truthData = self.dta.truthManager.idMapData[truthId]
@@ -236,7 +393,7 @@ class ReportGenerator(object):
     self._addFigures(figs, names, 2)
 
     # Deltas with uncertainty
-    plotDims = self.plotDict['ERROR']
+    plotDims = self.plotDict.get('ERROR', [])
     figs = []
     names = []
     truthData = self.dta.truthManager.idMapData[truthId]
@@ -254,39 +411,47 @@ class ReportGenerator(object):
       names.append('truth{2:d}WithTrack{3:d}Errors_{0:s}vs{1:s}.pdf'.format(xAxisTrk, yAxisTrk, truthId, trkId))
       if xAxisTrk == self.dta.trackManager._timeField:
         ax.plot(truthData[xAxisTruth], numpy.zeros(numpy.shape(truthData[xAxisTruth])), 'k-', markeredgecolor='k', markersize=8)
-        interpTruth = numpy.interp(trkData[xAxisTrk], truthData[xAxisTruth], truthData[yAxisTruth], left=numpy.nan, right=numpy.nan) 
+        interpTruth = self._getTruthAtTimes(truthData, trkData[xAxisTrk], xAxisTruth, yAxisTruth)
         ax.errorbar(trkData[xAxisTrk], trkData[yAxisTrk] - interpTruth,
             yerr=2.0*trkData['SIGMA_'+yAxisTrk], ecolor='w', markeredgecolor='w', linestyle='None', marker='o', markersize=5)
     self._addFigures(figs, names, 2)
 
-  def _makeTruthAssignmentSummary(self):
-    self.write('\\pagebreak')
-    self.write('\\section{Truth Assignments}')
-    times = self.dta.allTimeData.keys()
-    allTruthIds = self.dta.truthManager.idMapData.keys()
-    for iTruth, truthId in enumerate(allTruthIds):
-      self.write('\\subsection{Truth', truthId, 'Assignments}')
-      #print('Looking at truth', truthId)
-      trkAssignments = self.dta.truthAssignments[truthId]
-      trkAssignmentIds = numpy.array(trkAssignments['TRK_IDS'])
-      idx = numpy.where(trkAssignmentIds >= 0)
-      validTrackAssignments = trkAssignmentIds[idx]
-      self.write('Truth', truthId, 'assigned to tracks:', trkAssignmentIds, '\\\\')
+  def _getTruthAtTimes(self, truthData, times, timeField, fld):
+    # Truth is resampled to every track time before association, so its values at a track's times are
+    # looked up rather than interpolated again. Times outside the truth's span get NaN.
+    values = numpy.full(len(times), numpy.nan)
+    truthTimes = truthData[timeField]
+    if len(truthTimes) > 0:
+      idx = numpy.minimum(numpy.searchsorted(truthTimes, times), len(truthTimes) - 1)
+      found = truthTimes[idx] == times
+      values[found] = truthData[fld][idx[found]]
+    return values
+
+  def _makeTruthAssignments(self, truthId):
+    self.write('\\subsection{Truth', truthId, 'Assignments}')
+    #print('Looking at truth', truthId)
+    assignmentTimes, trkAssignmentIds, _ = self.dta.results.getTruthHistory(truthId)
+    idx = numpy.where(trkAssignmentIds >= 0)
+    validTrackAssignments = trkAssignmentIds[idx]
+    self.write('Truth', truthId, 'assigned to tracks:', trkAssignmentIds, '\\\\')
+    if numpy.size(validTrackAssignments) > 0:
       (uTrk, count) = numpy.unique(validTrackAssignments, return_counts=True)
       bestAssignedTrack = uTrk[numpy.argmax(count)]
       self.write('Truth', truthId, 'best assigned track:', bestAssignedTrack, os.linesep)
-      (uTrk, count) = numpy.unique(trkAssignmentIds, return_counts=True)
-      fig, ax = self._getSingleAxisFigure(xlabel='Time', ylabel='Assigned Track', title='Truth ' + str(truthId) + ' Assignments')
-      for iUTrk, trkId in enumerate(uTrk):
-        idx = numpy.squeeze(numpy.where(trkAssignmentIds == trkId))
-        #print('trackAssignments:', trackAssignments)
-        #print('idx:', idx, ' for trkId:', trkId)
-        #print(validTimes)
-        ax.plot(numpy.array(trkAssignments['TIME'])[idx], iUTrk * numpy.ones(numpy.shape(idx)), 's')
-      ax.set(ylim=(-0.1, len(uTrk) - 0.9))
-      ax.set(yticks=range(0, len(uTrk)), yticklabels=[str(trk) if trk >= 0 else 'Unassigned' for trk in uTrk])
-      self._addFigures([fig], [''.join(('truth', str(truthId), 'Assignments.pdf'))], 1)
-      #print('Done with truth', truthId)
+    else:
+      self.write('Truth', truthId, 'never assigned to a track.', os.linesep)
+    (uTrk, count) = numpy.unique(trkAssignmentIds, return_counts=True)
+    fig, ax = self._getSingleAxisFigure(xlabel='Time', ylabel='Assigned Track', title='Truth ' + str(truthId) + ' Assignments')
+    for iUTrk, trkId in enumerate(uTrk):
+      idx = numpy.squeeze(numpy.where(trkAssignmentIds == trkId))
+      #print('trackAssignments:', trackAssignments)
+      #print('idx:', idx, ' for trkId:', trkId)
+      #print(validTimes)
+      ax.plot(assignmentTimes[idx], iUTrk * numpy.ones(numpy.shape(idx)), 's')
+    ax.set(ylim=(-0.1, len(uTrk) - 0.9))
+    ax.set(yticks=range(0, len(uTrk)), yticklabels=[str(trk) if trk >= 0 else 'Unassigned' for trk in uTrk])
+    self._addFigures([fig], [''.join(('truth', str(truthId), 'Assignments.pdf'))], 1)
+    #print('Done with truth', truthId)
 
   def _addFigures(self, figs, names, numPerRow=1):
     self.write('\\begin{center}')
@@ -295,18 +460,27 @@ class ReportGenerator(object):
     for fig, name in zip(figs, names):
       fullName = os.path.join(self.outDir, name)
       #print('Saving figure', name)
-      fig.savefig(fullName)
-      plt.close(fig)
+      self.figureRenderer.add(fig, fullName)
       self.write('  \\includegraphics[width='+width+']{'+fullName+'}')
     self.write('\\end{minipage}')
     self.write('\\end{center}')
 
   def _getSingleAxisFigure(self, **kwargs):
-    fig = plt.figure()
-    ax = fig.add_subplot('111')
-    ax.set(**kwargs)
-    return (fig, ax)
+    # The job records the axis calls, so it is returned as both the figure and the axis
+    job = FigureRenderer.FigureJob(kwargs, self.plotRc, decimate=self.decimate, rasterizeMarkers=self.rasterizeMarkers)
+    return (job, job)
 
   def _setDefaultLineCycle(self, ax):
     ax.set(prop_cycle=self.defaultLineCycler)
 
+def _toJsonValue(value):
+  # NumPy scalars as Python ones, and NaN as None since JSON has no NaN
+  value = value.item() if isinstance(value, numpy.generic) else value
+  return None if isinstance(value, float) and numpy.isnan(value) else value
+
+def _htmlTable(table):
+  rows = ['<tr>' + ''.join('<th>{0:s}</th>'.format(html.escape(str(key))) for key in table.keys()) + '</tr>']
+  for row in zip(*table.values()):
+    rows.append('<tr>' + ''.join('<td>{0:s}</td>'.format('' if value is None else html.escape(str(value)))
+        for value in row) + '</tr>')
+  return '<table border="1">\n' + '\n'.join(rows) + '\n</table>\n'
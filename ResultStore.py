@@ -0,0 +1,105 @@
+import numpy
+
+class ResultStore(object):
+  # Association results held in flat arrays instead of per-time dicts. Each time adds one row of counts,
+  # and one event per truth (with its assigned track, or -1) plus one per track left unassigned (with truth
+  # -1), so the history of any truth or track can be read off the events. The arrays are preallocated and
+  # grow by doubling. Queries by ID use an index that is built on the first query after new times come in.
+  TIME_FIELDS = (('time', float), ('numTruths', int), ('numTrks', int), ('numAssigned', int),
+      ('numAssociated', int), ('eventEnd', int))
+  EVENT_FIELDS = (('time', float), ('truthId', int), ('trkId', int), ('score', float))
+
+  def __init__(self, numTimes=1024, numEvents=16384):
+    self.numTimes = 0
+    self.numEvents = 0
+    self._timeColumns = {fld: numpy.zeros(max(numTimes, 1), dtype) for fld, dtype in self.TIME_FIELDS}
+    self._eventColumns = {fld: numpy.zeros(max(numEvents, 1), dtype) for fld, dtype in self.EVENT_FIELDS}
+    self._idIndex = {}
+
+  def reserve(self, numTimes, numEvents):
+    # Makes room for at least this many times and events in total, so a run of known size never regrows
+    self._timeColumns = self._resize(self._timeColumns, self.numTimes, numTimes)
+    self._eventColumns = self._resize(self._eventColumns, self.numEvents, numEvents)
+
+  def _resize(self, columns, numUsed, numNeeded):
+    capacity = len(next(iter(columns.values())))
+    if numNeeded <= capacity:
+      return columns
+    newColumns = {}
+    for fld, fldData in columns.items():
+      newColumns[fld] = numpy.zeros(numNeeded, fldData.dtype)
+      newColumns[fld][0:numUsed] = fldData[0:numUsed]
+    return newColumns
+
+  def addTime(self, time, truthIds, truthTrks, truthScores, trkIds, trkTruths, numAssociated):
+    # Times must be added in increasing order. truthTrks holds the track ID assigned to each truth (or -1),
+    # truthScores the score of that assignment (NaN if none) and trkTruths the truth ID assigned to each track.
+    self.checkTimeOrder(time)
+    unassignedTrks = trkIds[trkTruths < 0]
+    numTruths = len(truthIds)
+    start = self.numEvents
+    mid = start + numTruths
+    end = mid + len(unassignedTrks)
+    timeCapacity = len(self._timeColumns['time'])
+    eventCapacity = len(self._eventColumns['time'])
+    self.reserve(timeCapacity if self.numTimes < timeCapacity else 2 * timeCapacity,
+        eventCapacity if end <= eventCapacity else max(end, 2 * eventCapacity))
+    events = self._eventColumns
+    events['time'][start:end] = time
+    events['truthId'][start:mid] = truthIds
+    events['truthId'][mid:end] = -1
+    events['trkId'][start:mid] = truthTrks
+    events['trkId'][mid:end] = unassignedTrks
+    events['score'][start:mid] = truthScores
+    events['score'][mid:end] = numpy.nan
+    row = self.numTimes
+    self._timeColumns['time'][row] = time
+    self._timeColumns['numTruths'][row] = numTruths
+    self._timeColumns['numTrks'][row] = len(trkIds)
+    self._timeColumns['numAssigned'][row] = numpy.count_nonzero(truthTrks >= 0)
+    self._timeColumns['numAssociated'][row] = numAssociated
+    self._timeColumns['eventEnd'][row] = end
+    self.numTimes += 1
+    self.numEvents = end
+    self._idIndex = {}
+
+  def checkTimeOrder(self, time):
+    # Raises unless time comes after every time added so far
+    if self.numTimes > 0 and time <= self._timeColumns['time'][self.numTimes - 1]:
+      raise RuntimeError('Results must be added in time order, got ' + str(time) + ' after ' +
+          str(self._timeColumns['time'][self.numTimes - 1]))
+
+  def getTimeColumn(self, fld):
+    # One value per time, in time order
+    return self._timeColumns[fld][0:self.numTimes]
+
+  def getEventColumn(self, fld):
+    return self._eventColumns[fld][0:self.numEvents]
+
+  def getTimeRange(self, startTime, endTime):
+    # Returns the per-time columns and the event columns of the times in [startTime, endTime]
+    times = self.getTimeColumn('time')
+    first = numpy.searchsorted(times, startTime, side='left')
+    last = numpy.searchsorted(times, endTime, side='right')
+    eventStart = self._timeColumns['eventEnd'][first - 1] if first > 0 else 0
+    eventEnd = self._timeColumns['eventEnd'][last - 1] if last > first else eventStart
+    timeColumns = {fld: fldData[first:last] for fld, fldData in self._timeColumns.items()}
+    eventColumns = {fld: fldData[eventStart:eventEnd] for fld, fldData in self._eventColumns.items()}
+    return (timeColumns, eventColumns)
+
+  def getTruthHistory(self, truthId):
+    # Returns the times the truth was present, the track assigned to it at each (-1 if none) and the scores
+    rows = self._getIdRows('truthId', truthId)
+    return (self._eventColumns['time'][rows], self._eventColumns['trkId'][rows], self._eventColumns['score'][rows])
+
+  def getTrackHistory(self, trkId):
+    # Returns the times the track was present, the truth it was assigned to at each (-1 if none) and the scores
+    rows = self._getIdRows('trkId', trkId)
+    return (self._eventColumns['time'][rows], self._eventColumns['truthId'][rows], self._eventColumns['score'][rows])
+
+  def _getIdRows(self, fld, id):
+    if fld not in self._idIndex:
+      order = numpy.argsort(self.getEventColumn(fld), kind='stable')
+      self._idIndex[fld] = (order, self._eventColumns[fld][order])
+    order, sortedIds = self._idIndex[fld]
+    return order[numpy.searchsorted(sortedIds, id, side='left'):numpy.searchsorted(sortedIds, id, side='right')]
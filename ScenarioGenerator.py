@@ -0,0 +1,138 @@
+import argparse
+import numpy
+
+class ScenarioGenerator(object):
+  # Generates a synthetic truth file and a noisy tracker output file for it, in the formats of truth.txt
+  # and tracks.txt. Targets fly straight at constant speed inside a square area, each over its own part of
+  # the scenario. The tracker reports on them once per scan with position noise, drops reports
+  # (dropoutRate), sometimes re-initiates a track under a new ID after a dropout (reinitRate), carries duals
+  # on some targets (dualRate) and reports false tracks. clutterDensity is the expected number of false
+  # tracks per scan per unit area, each living falseTrackLife scans. If tracksPerScan is given, the false
+  # track rate is instead set so the expected total number of reports per scan is tracksPerScan.
+  PARAMETERS = ('numTargets', 'duration', 'scanPeriod', 'truthPeriod', 'areaSize', 'speed', 'positionSigma',
+      'clutterDensity', 'tracksPerScan', 'dualRate', 'dropoutRate', 'reinitRate', 'falseTrackLife', 'seed')
+
+  def __init__(self, numTargets=100, duration=600.0, scanPeriod=1.0, truthPeriod=0.5, areaSize=10000.0,
+      speed=10.0, positionSigma=0.5, clutterDensity=1.0E-7, tracksPerScan=None, dualRate=0.05,
+      dropoutRate=0.05, reinitRate=0.2, falseTrackLife=5, seed=0):
+    self.numTargets = numTargets
+    self.duration = duration
+    self.scanPeriod = scanPeriod
+    self.truthPeriod = truthPeriod
+    self.areaSize = areaSize
+    self.speed = speed
+    self.positionSigma = positionSigma
+    self.clutterDensity = clutterDensity
+    self.tracksPerScan = tracksPerScan
+    self.dualRate = dualRate
+    self.dropoutRate = dropoutRate
+    self.reinitRate = reinitRate
+    self.falseTrackLife = falseTrackLife
+    self.seed = seed
+    self.rng = numpy.random.RandomState(seed)
+
+  def getParameters(self):
+    return {key: getattr(self, key) for key in self.PARAMETERS}
+
+  def generate(self, truthFile, trackFile):
+    # Writes both files, time ordered, and returns the number of rows in each
+    self._makeTargets()
+    numTruthRows = self._writeTruth(truthFile)
+    numTrackRows = self._writeTracks(trackFile)
+    return (numTruthRows, numTrackRows)
+
+  def _makeTargets(self):
+    n = self.numTargets
+    lifetime = self.rng.uniform(0.2, 1.0, n) * self.duration
+    self.startTimes = self.rng.uniform(0.0, self.duration - lifetime)
+    self.endTimes = self.startTimes + lifetime
+    self.startPos = self.rng.uniform(0.0, self.areaSize, (n, 2))
+    heading = self.rng.uniform(0.0, 2.0 * numpy.pi, n)
+    self.velocity = self.speed * numpy.column_stack((numpy.cos(heading), numpy.sin(heading)))
+
+  def _positions(self, targets, times):
+    return self.startPos[targets] + self.velocity[targets] * (times - self.startTimes[targets])[:, numpy.newaxis]
+
+  def _alive(self, times):
+    # All (target, time) pairs with the target alive, flattened in time order
+    alive = numpy.logical_and(self.startTimes[numpy.newaxis, :] <= times[:, numpy.newaxis],
+        times[:, numpy.newaxis] <= self.endTimes[numpy.newaxis, :])
+    iTime, target = numpy.nonzero(alive)
+    return (times[iTime], target)
+
+  def _writeTruth(self, truthFile):
+    times, targets = self._alive(numpy.arange(0.0, self.duration, self.truthPeriod))
+    pos = self._positions(targets, times)
+    table = numpy.column_stack((times, targets, pos))
+    numpy.savetxt(truthFile, table, fmt=('%.3f', '%d', '%.3f', '%.3f'), header='T ID X Y', comments='')
+    return len(table)
+
+  def _writeTracks(self, trackFile):
+    scanTimes = numpy.arange(0.0, self.duration, self.scanPeriod)
+    times, targets = self._alive(scanTimes)
+    # Track IDs: each target starts with its own, and a re-initiation after a dropout moves it to a new one.
+    # Re-initiations are counted per target in time order, so the new IDs stay unique.
+    dropped = self.rng.uniform(size=len(times)) < self.dropoutRate
+    reinit = numpy.logical_and(dropped, self.rng.uniform(size=len(times)) < self.reinitRate)
+    order = numpy.lexsort((times, targets))
+    numReinits = numpy.zeros(len(times), int)
+    cumReinits = numpy.cumsum(reinit[order])
+    firstOfTarget = numpy.searchsorted(targets[order], targets[order], side='left')
+    numReinits[order] = cumReinits - numpy.append(0, cumReinits)[firstOfTarget]
+    trkIds = 1 + targets + self.numTargets * numReinits
+    reported = numpy.logical_not(dropped)
+    rows = [self._noisyRows(times[reported], targets[reported], trkIds[reported])]
+
+    # Duals follow their target for its whole life under their own ID
+    hasDual = self.rng.uniform(size=self.numTargets) < self.dualRate
+    dualIdBase = 1 + self.numTargets * (1 + numpy.max(numReinits, initial=0))
+    isDual = numpy.logical_and(hasDual[targets], reported)
+    rows.append(self._noisyRows(times[isDual], targets[isDual], dualIdBase + targets[isDual]))
+
+    # False tracks start at a constant rate per scan and wander about a random point for their life
+    numTrue = len(times) / max(len(scanTimes), 1)
+    if self.tracksPerScan is not None:
+      falsePerScan = max(self.tracksPerScan - numTrue * (1.0 - self.dropoutRate + self.dualRate), 0.0)
+    else:
+      falsePerScan = self.clutterDensity * self.areaSize * self.areaSize
+    numStarts = self.rng.poisson(falsePerScan / self.falseTrackLife, len(scanTimes))
+    startScan = numpy.repeat(numpy.arange(len(scanTimes)), numStarts)
+    falseIds = dualIdBase + self.numTargets + numpy.arange(len(startScan))
+    falseScan = (startScan[:, numpy.newaxis] + numpy.arange(self.falseTrackLife)[numpy.newaxis, :]).ravel()
+    falseId = numpy.repeat(falseIds, self.falseTrackLife)
+    falseCenter = numpy.repeat(self.rng.uniform(0.0, self.areaSize, (len(startScan), 2)), self.falseTrackLife, axis=0)
+    inScenario = falseScan < len(scanTimes)
+    falsePos = falseCenter[inScenario] + self.rng.normal(0.0, self.positionSigma, (numpy.count_nonzero(inScenario), 2))
+    rows.append(self._makeRows(scanTimes[falseScan[inScenario]], falseId[inScenario], falsePos))
+
+    # Heartbeats mark every scan, even empty ones
+    rows.append(self._makeRows(scanTimes, -1 * numpy.ones(len(scanTimes), int), numpy.zeros((len(scanTimes), 2))))
+    table = numpy.concatenate(rows)
+    table = table[numpy.lexsort((table[:, 1], table[:, 0]))]
+    numpy.savetxt(trackFile, table, fmt=('%.3f', '%d', '%.3f', '%.3f', '%.3f', '%.3f'),
+        header='TIME ID X Y SIGMA_X SIGMA_Y', comments='')
+    return len(table)
+
+  def _noisyRows(self, times, targets, trkIds):
+    pos = self._positions(targets, times) + self.rng.normal(0.0, self.positionSigma, (len(times), 2))
+    return self._makeRows(times, trkIds, pos)
+
+  def _makeRows(self, times, trkIds, pos):
+    sigmas = self.positionSigma * numpy.ones((len(times), 2))
+    return numpy.column_stack((times, trkIds, pos, sigmas))
+
+if __name__ == '__main__':
+  ap = argparse.ArgumentParser()
+  ap.add_argument('--truth', type=str, dest='truthFile', default='syntheticTruth.txt', help='Truth file to write')
+  ap.add_argument('--track', type=str, dest='trackFile', default='syntheticTracks.txt', help='Track file to write')
+  ap.add_argument('--targets', type=int, dest='numTargets', default=100, help='Number of truth objects')
+  ap.add_argument('--duration', type=float, dest='duration', default=600.0, help='Scenario length')
+  ap.add_argument('--tracks-per-scan', type=float, dest='tracksPerScan', default=None,
+      help='Expected number of track reports per scan (overrides --clutter)')
+  ap.add_argument('--clutter', type=float, dest='clutterDensity', default=1.0E-7,
+      help='Expected false tracks per scan per unit area')
+  ap.add_argument('--seed', type=int, dest='seed', default=0, help='Random seed')
+  opts = ap.parse_args()
+  sg = ScenarioGenerator(numTargets=opts.numTargets, duration=opts.duration, tracksPerScan=opts.tracksPerScan,
+      clutterDensity=opts.clutterDensity, seed=opts.seed)
+  print('Wrote {0:d} truth rows and {1:d} track rows'.format(*sg.generate(opts.truthFile, opts.trackFile)))
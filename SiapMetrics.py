@@ -0,0 +1,199 @@
+import argparse
+from collections import OrderedDict
+import numpy
+import os
+
+class SiapMetrics(object):
+  # Single Integrated Air Picture metrics computed from a ResultStore, independent of the report:
+  #   completeness: assigned tracks / truth objects
+  #   false track ratio: (tracks - tracks associated with any truth) / tracks
+  #   ambiguity: associated tracks / assigned tracks
+  # Each comes overall, per time and over a trailing time window. Per-target and per-track breakdowns add
+  # track continuity: a segment is a run of consecutive times with the same assignment, and a switch is a
+  # change of assigned ID between two assigned times (gaps without an assignment don't count as switches).
+  # All results are OrderedDicts of column name -> array, which writeTable turns into CSV.
+
+  def __init__(self, results):
+    self.results = results
+    self.times = results.getTimeColumn('time')
+    self.numTruth = results.getTimeColumn('numTruths').astype(float)
+    self.numTrks = results.getTimeColumn('numTrks').astype(float)
+    self.numAssigned = results.getTimeColumn('numAssigned').astype(float)
+    self.numAssoc = results.getTimeColumn('numAssociated').astype(float)
+
+  def getOverall(self):
+    return getOverallRatios(*[numpy.sum(counts) for counts in
+        (self.numTruth, self.numTrks, self.numAssigned, self.numAssoc)])
+
+  def getPerTime(self):
+    table = OrderedDict((('time', self.times), ('numTruths', self.numTruth), ('numTrks', self.numTrks),
+        ('numAssigned', self.numAssigned), ('numAssociated', self.numAssoc)))
+    table.update(getRatios(self.numTruth, self.numTrks, self.numAssigned, self.numAssoc))
+    return table
+
+  def getWindowed(self, window):
+    # The metrics at each time over the times in (time - window, time]
+    first = numpy.searchsorted(self.times, self.times - window, side='right')
+    last = numpy.arange(1, len(self.times) + 1)
+    sums = []
+    for counts in (self.numTruth, self.numTrks, self.numAssigned, self.numAssoc):
+      cumulative = numpy.append(0.0, numpy.cumsum(counts))
+      sums.append(cumulative[last] - cumulative[first])
+    table = OrderedDict((('time', self.times),))
+    table.update(getRatios(*sums))
+    return table
+
+  def getPerTarget(self):
+    return self._getBreakdown('truthId', 'trkId', 'truthId')
+
+  def getPerTrack(self):
+    return self._getBreakdown('trkId', 'truthId', 'trkId')
+
+  def _getBreakdown(self, idFld, otherFld, idName):
+    # One row per ID of idFld, from its events sorted by (ID, time). The events are stored in time order, so
+    # a stable sort by ID is enough.
+    ids = self.results.getEventColumn(idFld)
+    others = self.results.getEventColumn(otherFld)
+    scores = self.results.getEventColumn('score')
+    order = numpy.argsort(ids, kind='stable')
+    order = order[ids[order] >= 0]
+    ids = ids[order]
+    others = others[order]
+    scores = scores[order]
+    if len(ids) > 0:
+      starts = numpy.flatnonzero(numpy.append(True, ids[1:] != ids[:-1]))
+    else:
+      starts = numpy.zeros(0, int)
+    numGroups = len(starts)
+    group = numpy.repeat(numpy.arange(numGroups), numpy.diff(numpy.append(starts, len(ids))))
+    assigned = others >= 0
+    isStart = numpy.zeros(len(ids), bool)
+    isStart[starts] = True
+    prevOthers = numpy.append(-1, others[:-1])
+    newSegment = assigned & (isStart | (others != prevOthers))
+    # Switches compare each assigned time with the previous assigned time of the same ID
+    assignedIdx = numpy.flatnonzero(assigned)
+    assignedGroup = group[assignedIdx]
+    assignedOthers = others[assignedIdx]
+    isSwitch = (assignedGroup[1:] == assignedGroup[:-1]) & (assignedOthers[1:] != assignedOthers[:-1])
+    # Distinct assigned IDs per ID
+    pairs = numpy.zeros((0, 2), int)
+    if len(assignedIdx) > 0:
+      pairs = numpy.unique(numpy.column_stack((assignedGroup, assignedOthers)), axis=0)
+    numPresent = numpy.bincount(group, minlength=numGroups)
+    numAssigned = numpy.bincount(group, weights=assigned, minlength=numGroups)
+    scoreSums = numpy.bincount(group[assigned], weights=scores[assigned], minlength=numGroups)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+      table = OrderedDict((
+        (idName, ids[starts]),
+        ('firstTime', self.results.getEventColumn('time')[order][starts]),
+        ('numTimes', numPresent),
+        ('numAssigned', numAssigned.astype(int)),
+        ('fractionAssigned', numAssigned / numPresent),
+        ('numAssignedIds', numpy.bincount(pairs[:, 0], minlength=numGroups)),
+        ('numSegments', numpy.bincount(group[newSegment], minlength=numGroups)),
+        ('numSwitches', numpy.bincount(assignedGroup[1:][isSwitch], minlength=numGroups)),
+        ('meanScore', numpy.where(numAssigned > 0, scoreSums / numAssigned, numpy.nan)),
+      ))
+    return table
+
+  def writeAll(self, baseName, window=None):
+    # Writes <baseName>Overall.csv, <baseName>PerTime.csv (with windowed columns if a window is given),
+    # <baseName>PerTarget.csv and <baseName>PerTrack.csv, returning the file names
+    perTime = self.getPerTime()
+    if window is not None:
+      for key, values in self.getWindowed(window).items():
+        if key != 'time':
+          perTime['windowed_' + key] = values
+    overall = OrderedDict((key, numpy.array([value])) for key, value in self.getOverall().items())
+    tables = (('Overall', overall), ('PerTime', perTime), ('PerTarget', self.getPerTarget()),
+        ('PerTrack', self.getPerTrack()))
+    fileNames = []
+    for suffix, table in tables:
+      fileNames.append(baseName + suffix + '.csv')
+      writeTable(fileNames[-1], table)
+    return fileNames
+
+class SiapTotals(object):
+  # Running sums behind the overall SIAP metrics, so each scan updates them in constant time. The metrics
+  # come from getOverallRatios, like those of SiapMetrics.
+
+  def __init__(self):
+    self.numScans = 0
+    self.numTruth = 0
+    self.numTrksTotal = 0
+    self.numAssociatedTrks = 0
+    self.numAssignedTrks = 0
+
+  def update(self, thisTimeData):
+    self.numScans += 1
+    self.numTruth += len(thisTimeData['validTruthIds'])
+    self.numTrksTotal += len(thisTimeData['validTrkIds'])
+    self.numAssociatedTrks += thisTimeData['numAssociatedTrks']
+    self.numAssignedTrks += thisTimeData['numAssignedTrks']
+
+  def getOverall(self):
+    return getOverallRatios(self.numTruth, self.numTrksTotal, self.numAssignedTrks, self.numAssociatedTrks)
+
+  def getCompleteness(self):
+    return self.getOverall()['completeness']
+
+  def getFalseTrackRatio(self):
+    return self.getOverall()['falseTrackRatio']
+
+  def getAmbiguity(self):
+    return self.getOverall()['ambiguity']
+
+def getRatios(numTruth, numTrks, numAssigned, numAssoc):
+  # The metrics from arrays of counts, NaN where there is nothing to divide by
+  with numpy.errstate(divide='ignore', invalid='ignore'):
+    ratios = OrderedDict((
+      ('completeness', numpy.where(numTruth > 0, numAssigned / numTruth, numpy.nan)),
+      ('falseTrackRatio', numpy.where(numTrks > 0, (numTrks - numAssoc) / numTrks, numpy.nan)),
+      ('ambiguity', numpy.where(numAssigned > 0, numAssoc / numAssigned, numpy.nan)),
+    ))
+  return ratios
+
+def getOverallRatios(numTruth, numTrks, numAssigned, numAssoc):
+  # The metrics from counts summed over all times
+  ratios = getRatios(*[numpy.array([count], float) for count in (numTruth, numTrks, numAssigned, numAssoc)])
+  return OrderedDict((key, values[0]) for key, values in ratios.items())
+
+def writeTable(fileName, table):
+  # table is an OrderedDict of column name -> array, all of the same length
+  with open(fileName, 'w') as tf:
+    tf.write(','.join(table.keys()) + os.linesep)
+    for row in zip(*table.values()):
+      tf.write(','.join(_formatValue(value) for value in row) + os.linesep)
+
+def _formatValue(value):
+  if isinstance(value, (float, numpy.floating)):
+    return repr(float(value))
+  return str(value)
+
+if __name__ == '__main__':
+  # Imported here since the analyzer's report builds on this module
+  import DataTruthAnalyzer
+  ap = argparse.ArgumentParser()
+  ap.add_argument('--track', type=str, dest='trackFile', help='Track file name')
+  ap.add_argument('--truth', type=str, dest='truthFile', help='Truth file name')
+  ap.add_argument('--assoc-mode', type=str, dest='assocMode', default='sparse', help='Association mode')
+  ap.add_argument('--stream', action='store_true', dest='streaming',
+      help='Read both files in chunks; only the overall metrics are computed, and no CSV files are written')
+  ap.add_argument('--window', type=float, dest='window', default=None,
+      help='Also compute the per-time metrics over a trailing window of this length')
+  ap.add_argument('--out', type=str, dest='baseName', default='siap', help='Base name of the CSV files')
+  opts = ap.parse_args()
+  dta = DataTruthAnalyzer.DataTruthAnalyzer(opts.trackFile, opts.truthFile, assocMode=opts.assocMode,
+      streaming=opts.streaming)
+  dta.assignTracksToTruth()
+  if opts.streaming:
+    # Streaming keeps no history, only the running totals
+    overall = dta.siapTotals.getOverall()
+  else:
+    sm = SiapMetrics(dta.results)
+    overall = sm.getOverall()
+  for key, value in overall.items():
+    print('{0:s}: {1:.6f}'.format(key, value))
+  if not opts.streaming:
+    print('Wrote', ', '.join(sm.writeAll(opts.baseName, opts.window)))
@@ -0,0 +1,239 @@
+from collections import deque
+import logging
+import numpy
+import pandas
+
+logger = logging.getLogger(__name__)
+
+class StreamingReader(object):
+  # Reads a time-ordered, whitespace-delimited file in chunks of rows and yields (time, data) for every time
+  # in it, where data is a dict of field -> array ordered by ID. Only one chunk (plus the rows of a time that
+  # straddles two chunks) is held in memory at once. Negative IDs are heartbeats: their times are yielded,
+  # but their rows are not.
+
+  def __init__(self, filename, hasId=True, chunkRows=100000):
+    self.filename = filename
+    self.hasId = hasId
+    self.chunkRows = chunkRows
+    self._timeField = None
+
+  def __iter__(self):
+    logger.info('I am going to stream file: %s', self.filename)
+    carry = None
+    lastTime = None
+    for chunk in pandas.read_table(self.filename, comment='#', delim_whitespace=True, chunksize=self.chunkRows):
+      if self._timeField is None:
+        self._setTimeField(chunk.keys())
+      columns = {fld: chunk[fld].values for fld in chunk.keys()}
+      if carry is not None:
+        columns = {fld: numpy.concatenate((carry[fld], fldData)) for fld, fldData in columns.items()}
+      times = columns[self._timeField]
+      if len(times) == 0:
+        continue
+      if numpy.any(numpy.diff(times) < 0) or (lastTime is not None and times[0] <= lastTime):
+        raise RuntimeError('File ' + self.filename + ' is not in time order, which streaming requires')
+      # The last time in the chunk may continue into the next one, so hold it back
+      split = numpy.searchsorted(times, times[-1], side='left')
+      carry = {fld: fldData[split:] for fld, fldData in columns.items()}
+      for time, data in self._splitTimes({fld: fldData[:split] for fld, fldData in columns.items()}):
+        lastTime = time
+        yield (time, data)
+    if carry is not None:
+      for time, data in self._splitTimes(carry):
+        yield (time, data)
+    logger.info('Done streaming file: %s', self.filename)
+
+  def getTimeField(self):
+    return self._timeField
+
+  def _setTimeField(self, fldArray):
+    if 'T' in fldArray:
+      self._timeField = 'T'
+    elif 'TIME' in fldArray:
+      self._timeField = 'TIME'
+    else:
+      raise RuntimeError('Unknown time field in:' + str(fldArray))
+
+  def _splitTimes(self, columns):
+    times = columns[self._timeField]
+    uTimes, starts = numpy.unique(times, return_index=True)
+    ends = numpy.append(starts[1:], len(times))
+    for time, start, end in zip(uTimes, starts, ends):
+      data = {fld: fldData[start:end] for fld, fldData in columns.items()}
+      if self.hasId:
+        # Drop heartbeats and order by ID, matching DataManager.getDataAtTime
+        ids = data['ID']
+        order = numpy.argsort(ids, kind='stable')
+        order = order[ids[order] >= 0]
+        data = {fld: fldData[order] for fld, fldData in data.items()}
+        sortedIds = data['ID']
+        dup = numpy.where(sortedIds[1:] == sortedIds[:-1])[0]
+        if len(dup) > 0:
+          raise RuntimeError('Track', sortedIds[dup[0]], 'has duplicate data at time', time)
+      yield (time, data)
+
+
+class StreamingTruthInterpolator(object):
+  # Linearly interpolates a streamed truth file to requested times, which must not decrease. Per ID, only the
+  # last sample at or before the requested time is kept, along with the samples read ahead up to `lookahead`
+  # past it, so memory is bounded by that window rather than by the file. An ID with no sample inside the
+  # window on either side of a requested time is treated as not existing at that time, the way
+  # DataManager.interpolateToTimeAxis treats times outside of an ID's span.
+  # The samples read ahead are packed into one buffer as they are read, each linked to the next sample of its
+  # ID, and every kept ID holds its next sample, so a call costs time in the rows read and the IDs kept rather
+  # than in the size of the window.
+
+  def __init__(self, filename, lookahead=60.0, chunkRows=100000):
+    self.lookahead = lookahead
+    self._reader = StreamingReader(filename, hasId=True, chunkRows=chunkRows)
+    self._timeIter = iter(self._reader)
+    self._exhausted = False
+    self._flds = None
+    # (time, first row, end row) of each time read ahead, with rows numbered from the start of the file
+    self._ahead = deque()
+    # Packed rows read ahead, holding rows _bufBase onwards, and the row of each ID's latest sample read
+    self._bufBase = 0
+    self._bufEnd = 0
+    self._bufIds = numpy.zeros(0, int)
+    self._bufTimes = numpy.zeros(0)
+    self._bufValues = None
+    self._bufNext = numpy.zeros(0, int)
+    self._tailIds = numpy.zeros(0, int)
+    self._tailRows = numpy.zeros(0, int)
+    # Last sample at or before the requested time of every kept ID, and its next sample if read
+    self._lastIds = numpy.zeros(0, int)
+    self._lastTimes = numpy.zeros(0)
+    self._lastValues = None
+    self._hasNext = numpy.zeros(0, bool)
+    self._nextTimes = numpy.zeros(0)
+    self._nextValues = None
+
+  def getDataAtTime(self, time):
+    # Returns a dict of field -> array for every ID that exists at this time, ordered by ID
+    while not self._exhausted and (len(self._ahead) == 0 or self._ahead[-1][0] < time + self.lookahead):
+      try:
+        self._readAhead(*next(self._timeIter))
+      except StopIteration:
+        self._exhausted = True
+    if self._flds is None:
+      return {'ID': numpy.zeros(0)}
+    while len(self._ahead) > 0 and self._ahead[0][0] <= time:
+      self._absorb(*self._ahead.popleft())
+    # Drop IDs whose last sample fell out of the window
+    keep = self._lastTimes >= time - self.lookahead
+    self._setLast(self._lastIds[keep], self._lastTimes[keep], self._lastValues[keep], self._hasNext[keep],
+        self._nextTimes[keep], self._nextValues[keep])
+
+    hasNext = self._hasNext
+    exact = self._lastTimes == time
+    interp = numpy.logical_and(hasNext, numpy.logical_not(exact))
+    values = self._lastValues.copy()
+    t0 = self._lastTimes[interp]
+    v0 = self._lastValues[interp]
+    slope = (self._nextValues[interp] - v0) / (self._nextTimes[interp] - t0)[:, numpy.newaxis]
+    values[interp] = slope * (time - t0)[:, numpy.newaxis] + v0
+    valid = numpy.logical_or(exact, hasNext)
+    values = values[valid]
+    data = {fld: values[:, iFld] for iFld, fld in enumerate(self._flds)}
+    data['ID'] = self._lastIds[valid]
+    data[self._reader.getTimeField()] = numpy.full(numpy.count_nonzero(valid), float(time))
+    return data
+
+  def _readAhead(self, time, data):
+    # Appends the samples of a time to the buffer, linking each to the previous sample of its ID. An ID whose
+    # previous sample was already absorbed gets this one as its next sample.
+    if self._flds is None:
+      self._flds = [fld for fld in data.keys() if fld not in ('ID', self._reader.getTimeField())]
+      self._bufValues = numpy.zeros((0, len(self._flds)))
+      self._lastValues = numpy.zeros((0, len(self._flds)))
+      self._nextValues = numpy.zeros((0, len(self._flds)))
+    ids = numpy.asarray(data['ID']).astype(int)
+    values = self._packValues(data)
+    numRows = len(ids)
+    self._reserve(numRows)
+    start = self._bufEnd
+    rows = start + numpy.arange(numRows)
+    offset = start - self._bufBase
+    self._bufIds[offset:offset + numRows] = ids
+    self._bufTimes[offset:offset + numRows] = time
+    self._bufValues[offset:offset + numRows] = values
+    self._bufNext[offset:offset + numRows] = -1
+    self._bufEnd += numRows
+    self._ahead.append((time, start, self._bufEnd))
+
+    # ids are sorted, as StreamingReader orders each time by ID
+    firstUnabsorbed = self._ahead[0][1]
+    prevRows = numpy.full(numRows, -1)
+    if len(self._tailIds) > 0:
+      pos = numpy.minimum(numpy.searchsorted(self._tailIds, ids), len(self._tailIds) - 1)
+      found = self._tailIds[pos] == ids
+      prevRows[found] = self._tailRows[pos[found]]
+    inBuffer = prevRows >= firstUnabsorbed
+    self._bufNext[prevRows[inBuffer] - self._bufBase] = rows[inBuffer]
+    absorbed = numpy.logical_and(prevRows >= 0, numpy.logical_not(inBuffer))
+    if numpy.any(absorbed) and len(self._lastIds) > 0:
+      pos = numpy.minimum(numpy.searchsorted(self._lastIds, ids[absorbed]), len(self._lastIds) - 1)
+      found = self._lastIds[pos] == ids[absorbed]
+      self._hasNext[pos[found]] = True
+      self._nextTimes[pos[found]] = time
+      self._nextValues[pos[found]] = values[absorbed][found]
+    allIds = numpy.union1d(self._tailIds, ids)
+    tailRows = numpy.zeros(len(allIds), int)
+    tailRows[numpy.searchsorted(allIds, self._tailIds)] = self._tailRows
+    tailRows[numpy.searchsorted(allIds, ids)] = rows
+    self._tailIds = allIds
+    self._tailRows = tailRows
+
+  def _reserve(self, numRows):
+    # Makes room for numRows more rows, dropping the absorbed rows at the front and growing if still short
+    firstLive = self._ahead[0][1] if len(self._ahead) > 0 else self._bufEnd
+    if self._bufEnd + numRows - self._bufBase <= len(self._bufIds):
+      return
+    live = slice(firstLive - self._bufBase, self._bufEnd - self._bufBase)
+    numLive = self._bufEnd - firstLive
+    capacity = max(len(self._bufIds), 2 * (numLive + numRows), 1024)
+    for name in ('_bufIds', '_bufTimes', '_bufValues', '_bufNext'):
+      old = getattr(self, name)
+      new = numpy.zeros((capacity,) + old.shape[1:], old.dtype)
+      new[0:numLive] = old[live]
+      setattr(self, name, new)
+    self._bufBase = firstLive
+
+  def _packValues(self, data):
+    return numpy.column_stack([numpy.asarray(data[fld], float) for fld in self._flds]) if len(self._flds) > 0 \
+        else numpy.zeros((len(data['ID']), 0))
+
+  def _absorb(self, time, start, end):
+    # Makes the samples of this time the latest known sample of their IDs, each with the next one it links to
+    rows = numpy.arange(start, end) - self._bufBase
+    ids = self._bufIds[rows]
+    nextRows = self._bufNext[rows]
+    hasNext = nextRows >= 0
+    nextIdx = nextRows[hasNext] - self._bufBase
+    allIds = numpy.union1d(self._lastIds, ids)
+    times = numpy.zeros(len(allIds))
+    values = numpy.zeros((len(allIds), len(self._flds)))
+    allHasNext = numpy.zeros(len(allIds), bool)
+    nextTimes = numpy.zeros(len(allIds))
+    nextValues = numpy.zeros((len(allIds), len(self._flds)))
+    idx = numpy.searchsorted(allIds, self._lastIds)
+    times[idx] = self._lastTimes
+    values[idx] = self._lastValues
+    allHasNext[idx] = self._hasNext
+    nextTimes[idx] = self._nextTimes
+    nextValues[idx] = self._nextValues
+    idx = numpy.searchsorted(allIds, ids)
+    times[idx] = time
+    values[idx] = self._bufValues[rows]
+    allHasNext[idx] = hasNext
+    nextTimes[idx[hasNext]] = self._bufTimes[nextIdx]
+    nextValues[idx[hasNext]] = self._bufValues[nextIdx]
+    self._setLast(allIds, times, values, allHasNext, nextTimes, nextValues)
+
+  def _setLast(self, ids, times, values, hasNext, nextTimes, nextValues):
+    self._lastIds = ids
+    self._lastTimes = times
+    self._lastValues = values
+    self._hasNext = hasNext
+    self._nextTimes = nextTimes
+    self._nextValues = nextValues